@@ -1,4 +1,5 @@
 import re
+import time
 import logging
 
 from crits.services.core import Service, ServiceConfigError
@@ -7,10 +8,40 @@ from crits.raw_data.raw_data import RawData
 from crits.samples.sample import Sample
 from crits.domains.domain import TLD
 from crits.indicators.indicator import Indicator
-from crits.core.data_tools import make_ascii_strings
 
 logger = logging.getLogger(__name__)
 
+IP_PATTERN = r"((25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)([ (\[]?(\.|dot)[ )\]]?(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)){3})"
+DOMAIN_PATTERN = r'[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?[\.[a-zA-Z]{2,}'
+EMAIL_PATTERN = r'[a-zA-Z0-9-\.\+]+@.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?[\.[a-zA-Z]{2,}'
+
+# Emails are tried first so the domain inside them is not matched on its own
+# before the whole address is seen.
+_miner_re = re.compile(r'(?P<email>%s)|(?P<ip>%s)|(?P<domain>%s)' %
+                       (EMAIL_PATTERN, IP_PATTERN, DOMAIN_PATTERN))
+_ip_re = re.compile(IP_PATTERN)
+_domain_re = re.compile(DOMAIN_PATTERN)
+_ip_cleanup_re = re.compile(r"[ ()\[\]]")
+
+# Seconds before the TLD list is reloaded from the database.
+TLD_REFRESH = 3600
+
+# Maximum number of values in a single $in query.
+LOOKUP_BATCH_SIZE = 1000
+
+# Sample data is read and searched for strings in blocks of this size.
+STRINGS_CHUNK_SIZE = 1024 * 1024
+# Longest unfinished string carried over to the next block. Longer strings
+# are split.
+STRINGS_MAX_CARRY = 64 * 1024
+STRINGS_MIN_LENGTH = 4
+
+_ascii_re = re.compile('[ -~]{%d,}' % STRINGS_MIN_LENGTH)
+_wide_re = re.compile('(?:[ -~]\x00){%d,}' % STRINGS_MIN_LENGTH)
+# Matches, on reversed data, the bytes at the end of a block which could be
+# part of an ASCII or UTF-16LE string continuing in the next block.
+_carry_re = re.compile('(?:[ -~]|\x00(?!\x00))*')
+
 
 class DataMinerService(Service):
     """
@@ -22,7 +53,7 @@ class DataMinerService(Service):
     """
 
     name = "DataMiner"
-    version = '1.0.0'
+    version = '1.2.0'
     template = "data_miner_service_template.html"
     supported_types = ['Event', 'RawData', 'Sample']
     description = "Mine a chunk of data for useful information."
@@ -39,77 +70,139 @@ class DataMinerService(Service):
         elif isinstance(obj, RawData):
             data = obj.data
         elif isinstance(obj, Sample):
-            samp_data = obj.filedata.read()
-            data = make_ascii_strings(data=samp_data)
-            if not data:
+            data = None
+        else:
+            self._debug("This type is not supported by this service.")
+            return
+
+        if data is None:
+            # Mine the strings of the sample a block at a time so memory use
+            # does not depend on the sample size.
+            (ips, domains, emails) = ([], [], [])
+            found = False
+            for strings in iter_strings(obj.filedata.read):
+                found = True
+                (chunk_ips, chunk_domains, chunk_emails) = mine('\n'.join(strings))
+                ips.extend(chunk_ips)
+                domains.extend(chunk_domains)
+                emails.extend(chunk_emails)
+            if not found:
                 self._debug("Could not find sample data to parse.")
                 return
         else:
-            self._debug("This type is not supported by this service.")
+            (ips, domains, emails) = mine(data)
+        for (subtype, type_, values) in [('Potential IP Address', "IP Address", ips),
+                                         ('Potential Domains', "Domain", domains),
+                                         ('Potential Emails', "Email", emails)]:
+            existing = lookup_indicators(values)
+            for value in values:
+                tdict = {'Type': type_}
+                if value in existing:
+                    tdict['exists'] = existing[value]
+                self._add_result(subtype, value, tdict)
+
+_tlds = None
+_tlds_loaded = 0
+
+def get_tlds():
+    """
+    Return the set of known TLDs, loaded once per process and refreshed
+    every TLD_REFRESH seconds.
+    """
+    global _tlds, _tlds_loaded
+    if _tlds is None or time.time() - _tlds_loaded > TLD_REFRESH:
+        _tlds = set(tld.tld for tld in TLD.objects().only('tld'))
+        _tlds_loaded = time.time()
+    return _tlds
+
+def lookup_indicators(values):
+    """
+    Return a dictionary of value to Indicator id for the values which
+    already exist as Indicators, using batched $in queries.
+    """
+    existing = {}
+    values = list(set(values))
+    for i in xrange(0, len(values), LOOKUP_BATCH_SIZE):
+        batch = values[i:i + LOOKUP_BATCH_SIZE]
+        for ind in Indicator.objects(value__in=batch).only('id', 'value'):
+            existing.setdefault(ind.value, str(ind.id))
+    return existing
+
+def _has_known_tld(item, tlds):
+    return len(item) > 1 and item.find('.') != -1 and item.split(".")[-1] in tlds
+
+def iter_strings(read, chunk_size=STRINGS_CHUNK_SIZE):
+    """
+    Read data with read(chunk_size) until it is exhausted and yield a list
+    of the ASCII and UTF-16LE (decoded to ASCII) strings found in each block.
+
+    Bytes at the end of a block which may be the start of a string are
+    carried over to the next block, so strings spanning blocks are found
+    whole and exactly once.
+    """
+    carry = ''
+    while True:
+        chunk = read(chunk_size)
+        data = carry + chunk
+        if not data:
+            return
+        if chunk:
+            window = data[-STRINGS_MAX_CARRY:]
+            size = _carry_re.match(window[::-1]).end()
+            if size == STRINGS_MAX_CARRY:
+                size = 0
+            end = len(data) - size
+        else:
+            end = len(data)
+        strings = [m.group() for m in _ascii_re.finditer(data, 0, end)]
+        strings.extend(m.group()[::2] for m in _wide_re.finditer(data, 0, end))
+        if strings:
+            yield strings
+        carry = data[end:]
+        if not chunk:
             return
 
-        ips = extract_ips(data)
-        for ip in ips:
-            tdict = {'Type': "IP Address"}
-            id_ = Indicator.objects(value=ip).only('id').first()
-            if id_:
-                tdict['exists'] = str(id_.id)
-            self._add_result('Potential IP Address', ip, tdict)
-        domains = extract_domains(data)
-        for domain in domains:
-            tdict = {'Type': "Domain"}
-            id_ =  Indicator.objects(value=domain).only('id').first()
-            if id_:
-                tdict['exists'] = str(id_.id)
-            self._add_result('Potential Domains', domain, tdict)
-        emails = extract_emails(data)
-        for email in emails:
-            tdict = {'Type': "Email"}
-            id_ = Indicator.objects(value=email).only('id').first()
-            if id_:
-                tdict['exists'] = str(id_.id)
-            self._add_result('Potential Emails', email, tdict)
+def _clean_ip(item):
+    return _ip_cleanup_re.sub("", item).replace("dot", ".")
+
+def mine(data):
+    """
+    Extract potential IP addresses, domains and email addresses from data in
+    a single pass. Returns a tuple of three lists, in the order they were
+    found.
+    """
+    tlds = get_tlds()
+    ips = []
+    domains = []
+    emails = []
+    for match in _miner_re.finditer(data):
+        kind = match.lastgroup
+        item = match.group(kind)
+        if kind == 'ip':
+            ips.append(_clean_ip(item))
+        elif kind == 'domain':
+            if _has_known_tld(item, tlds):
+                domains.append(item)
+        else:
+            if _has_known_tld(item, tlds):
+                emails.append(item)
+            # Addresses can contain IPs and domains which the separate
+            # extractors used to report as well.
+            for ip in _ip_re.findall(item):
+                ips.append(_clean_ip(ip[0]))
+            for domain in _domain_re.findall(item):
+                if _has_known_tld(domain, tlds):
+                    domains.append(domain)
+    return (ips, domains, emails)
 
 # hack of a parser to extract potential ip addresses from data
 def extract_ips(data):
-    pattern = r"((25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)([ (\[]?(\.|dot)[ )\]]?(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)){3})"
-    ips = [each[0] for each in re.findall(pattern, data)]
-    for item in ips:
-        location = ips.index(item)
-        ip = re.sub("[ ()\[\]]", "", item)
-        ip = re.sub("dot", ".", ip)
-        ips.remove(item)
-        ips.insert(location, ip)
-    return ips
+    return mine(data)[0]
 
 # hack of a parser to extract potential domains from data
 def extract_domains(data):
-    pattern = r'[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?[\.[a-zA-Z]{2,}'
-    domains = [each for each in re.findall(pattern, data) if len(each) > 0]
-    final_domains = []
-    for item in domains:
-        if len(item) > 1 and item.find('.') != -1:
-            try:
-                tld = item.split(".")[-1]
-                check = TLD.objects(tld=tld).first()
-                if check:
-                    final_domains.append(item)
-            except:
-                pass
-    return final_domains
+    return mine(data)[1]
 
 # hack of a parser to extract potential emails from data
 def extract_emails(data):
-    pattern = r'[a-zA-Z0-9-\.\+]+@.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?[\.[a-zA-Z]{2,}'
-    emails = [each for each in re.findall(pattern, data) if len(each) > 0]
-    final_emails = []
-    for item in emails:
-        if len(item) > 1 and item.find('.') != -1:
-            try:
-                tld = item.split(".")[-1]
-                check = TLD.objects(tld=tld).first()
-                if check:
-                    final_emails.append(item)
-            except:
-                pass
-    return final_emails
+    return mine(data)[2]
@@ -3,15 +3,13 @@
 # All rights reserved.
 # Source code distributed pursuant to license agreement.
 
-import array
-import math
-from decimal import *
-
 from django.template.loader import render_to_string
 
 from crits.services.core import Service, ServiceConfigError
 
 from . import forms
+from .entropy import (downsample, entropy, entropy_profile,
+                      high_entropy_regions, profile_length)
 
 class EntropycalcService(Service):
     """
@@ -19,10 +17,17 @@ class EntropycalcService(Service):
     """
 
     name = "entropycalc"
-    version = '0.0.1'
+    version = '0.1.0'
     supported_types = ['Sample']
     description = "Calculate entropy of a sample."
 
+    # Windows at or above this entropy are reported as high entropy regions.
+    HIGH_ENTROPY = 7.2
+    # Bounds on what is stored for large samples or small steps, so results
+    # stay well inside the Mongo document size limit.
+    MAX_PROFILE_POINTS = 4096
+    MAX_REGIONS = 100
+
     @staticmethod
     def get_config(existing_config):
         # This service no longer uses config options, so blow away any existing
@@ -38,7 +43,10 @@ class EntropycalcService(Service):
     def bind_runtime_form(analyst, config):
         if config:
             # The values are submitted as a list for some reason.
-            data = {'start': config['start'][0], 'end': config['end'][0]}
+            data = {}
+            for name in ('start', 'end', 'window', 'step'):
+                if name in config:
+                    data[name] = config[name][0]
         else:
             data = {}
             fields = forms.EntropyCalcRunForm().fields
@@ -54,31 +62,46 @@ class EntropycalcService(Service):
                                  'crits_type': crits_type,
                                  'identifier': identifier})
 
-    def _calculate_entropy(self, data):
-        entropy = Decimal(0)
-        if len(data) == 0:
-            return entropy
-
-        occurences = array.array('L', [0]*256)
-
-        for x in data:
-            occurences[ord(x)] += 1
-
-        for x in occurences:
-            if x:
-                p_x = Decimal(x) / len(data)
-                entropy -= p_x * Decimal(math.log(p_x, 2))
-
-        return entropy
-
-
     def run(self, obj, config):
         start = config['start']
         end = config['end']
         data = obj.filedata.read()
         # If end is -1, just leave it off.
         if end == -1:
-            output = self._calculate_entropy(data[start:])
+            data = data[start:]
         else:
-            output = self._calculate_entropy(data[start:end])
+            data = data[start:end]
+        output = entropy(data)
         self._add_result('Entropy calculation', "%.1f" % output, {'Value': "%.15f" % output})
+
+        window = config.get('window') or 0
+        step = config.get('step') or window
+        if window <= 0:
+            return
+        nwindows = profile_length(len(data), window, step)
+        if not nwindows:
+            return
+        # Each stored value is the maximum of per_point consecutive windows.
+        per_point = -(-nwindows // self.MAX_PROFILE_POINTS)
+        points = []
+        try:
+            regions = high_entropy_regions(downsample(entropy_profile(data, window, step),
+                                                      per_point, points),
+                                           window, self.HIGH_ENTROPY)
+        except ValueError, e:
+            self._error("Entropy profile: %s" % e)
+            return
+        description = "%d byte window, %d byte step" % (window, step)
+        if per_point > 1:
+            description += ", maximum of every %d windows" % per_point
+        self._add_result('Entropy profile', description,
+                         {'Offset': start,
+                          'Step': step * per_point,
+                          'Values': ["%.3f" % value for value in points]})
+        if len(regions) > self.MAX_REGIONS:
+            self._info("High entropy regions limited to the first %d of %d"
+                       % (self.MAX_REGIONS, len(regions)))
+        for (region_start, region_end, value) in regions[:self.MAX_REGIONS]:
+            self._add_result('High entropy region',
+                             "0x%x-0x%x" % (start + region_start, start + region_end),
+                             {'Max': "%.3f" % value})
@@ -0,0 +1,153 @@
+import numpy
+
+# Upper bounds on the working set of entropy_profile(). Windows are
+# processed in segments so memory use does not grow with the sample size.
+# A single window must fit in a segment, so window // gcd(window, step) can
+# be at most MAX_SEGMENT_BLOCKS.
+MAX_SEGMENT_BLOCKS = 16384
+MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _as_array(data):
+    return numpy.frombuffer(data, dtype=numpy.uint8)
+
+
+def byte_histogram(data):
+    """
+    Return a 256 element array with the number of occurrences of each byte
+    value in data.
+    """
+
+    return numpy.bincount(_as_array(data), minlength=256)
+
+
+def histogram_entropy(histograms):
+    """
+    Return the Shannon entropy, in bits per byte, of one histogram or of
+    each row of a two dimensional array of histograms.
+    """
+
+    histograms = numpy.asarray(histograms, dtype=numpy.float64)
+    totals = histograms.sum(axis=-1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        p = histograms / numpy.expand_dims(totals, -1)
+        logs = numpy.where(p > 0, numpy.log2(p), 0)
+    entropy = -(p * logs).sum(axis=-1)
+    return numpy.where(totals > 0, entropy, 0)
+
+
+def entropy(data):
+    """
+    Return the Shannon entropy of data in bits per byte.
+    """
+
+    if not len(data):
+        return 0.0
+    return float(histogram_entropy(byte_histogram(data)))
+
+
+def profile_blocks(window, step):
+    """
+    Return the number of blocks each window of a profile is split into.
+    """
+
+    return window // _gcd(window, step)
+
+
+def profile_length(size, window, step):
+    """
+    Return the number of windows in the profile of size bytes of data.
+    """
+
+    if size < window:
+        return 0
+    return (size - window) // step + 1
+
+
+def entropy_profile(data, window, step):
+    """
+    Generate (offset, entropy) tuples for each window of data.
+
+    Windows are window bytes long and start every step bytes. Trailing
+    bytes which do not fill a window are not included. The data is split
+    into blocks of gcd(window, step) bytes, all block histograms are counted
+    in a single bincount and each window histogram is the difference of two
+    cumulative block histograms, so no byte is counted more than once.
+    """
+
+    if window <= 0 or step <= 0:
+        raise ValueError("Window and step must be positive.")
+    if profile_blocks(window, step) > MAX_SEGMENT_BLOCKS:
+        raise ValueError("Window must be at most %d times gcd(window, step)."
+                         % MAX_SEGMENT_BLOCKS)
+    arr = _as_array(data)
+    nwindows = profile_length(len(arr), window, step)
+
+    block = _gcd(window, step)
+    blocks_per_window = window // block
+    blocks_per_step = step // block
+    # Each segment of count windows covers (count - 1) * step + window bytes.
+    per_segment = max(1, min((MAX_SEGMENT_BLOCKS - blocks_per_window) // blocks_per_step + 1,
+                             (MAX_SEGMENT_BYTES - window) // step + 1))
+
+    for first in xrange(0, nwindows, per_segment):
+        count = min(per_segment, nwindows - first)
+        start = first * step
+        segment = arr[start:start + (count - 1) * step + window]
+        nblocks = len(segment) // block
+
+        # Counting (block number * 256 + byte value) gives every block
+        # histogram at once.
+        index = (numpy.arange(len(segment)) // block) * 256 + segment
+        blocks = numpy.bincount(index, minlength=nblocks * 256)
+        blocks = blocks.reshape(nblocks, 256)
+        cumulative = numpy.zeros((nblocks + 1, 256), dtype=blocks.dtype)
+        numpy.cumsum(blocks, axis=0, out=cumulative[1:])
+
+        lo = numpy.arange(count) * blocks_per_step
+        histograms = cumulative[lo + blocks_per_window] - cumulative[lo]
+        values = histogram_entropy(histograms)
+        offsets = start + numpy.arange(count) * step
+        for point in zip(offsets.tolist(), values.tolist()):
+            yield point
+
+
+def downsample(profile, per_point, points):
+    """
+    Pass an entropy profile through unchanged, appending the maximum entropy
+    of every per_point consecutive windows to points.
+    """
+
+    for (i, (offset, value)) in enumerate(profile):
+        if i % per_point:
+            points[-1] = max(points[-1], value)
+        else:
+            points.append(value)
+        yield (offset, value)
+
+
+def high_entropy_regions(profile, window, threshold):
+    """
+    Merge consecutive windows of an entropy profile at or above threshold
+    into a list of (start, end, max entropy) regions.
+    """
+
+    regions = []
+    current = None
+    for offset, value in profile:
+        if value >= threshold:
+            if current and offset <= current[1]:
+                current[1] = offset + window
+                current[2] = max(current[2], value)
+            else:
+                current = [offset, offset + window, value]
+                regions.append(current)
+        else:
+            current = None
+    return [tuple(region) for region in regions]
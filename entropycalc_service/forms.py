@@ -1,5 +1,10 @@
 from django import forms
 
+from .entropy import MAX_SEGMENT_BLOCKS, profile_blocks
+
+# Largest profile window and step accepted on the run form.
+MAX_PROFILE_WINDOW = 1024 * 1024
+
 class EntropyCalcRunForm(forms.Form):
     error_css_class = 'error'
     required_css_class = 'required'
@@ -9,6 +14,28 @@ class EntropyCalcRunForm(forms.Form):
     end = forms.IntegerField(required=True,
                              label="End offset",
                              initial=-1)
+    window = forms.IntegerField(required=False,
+                                label="Profile window",
+                                initial=4096,
+                                min_value=0,
+                                max_value=MAX_PROFILE_WINDOW,
+                                help_text="Size in bytes of each window in the entropy profile, at most 1MB. 0 disables the profile.")
+    step = forms.IntegerField(required=False,
+                              label="Profile step",
+                              initial=4096,
+                              min_value=1,
+                              max_value=MAX_PROFILE_WINDOW,
+                              help_text="Distance in bytes between the start of each profile window, at most 1MB.")
 
     def __init__(self, *args, **kwargs):
         super(EntropyCalcRunForm, self).__init__(*args, **kwargs)
+
+    def clean(self):
+        cleaned_data = super(EntropyCalcRunForm, self).clean()
+        window = cleaned_data.get('window')
+        step = cleaned_data.get('step') or window
+        if window and step and profile_blocks(window, step) > MAX_SEGMENT_BLOCKS:
+            raise forms.ValidationError("Profile window must be at most %d times "
+                                        "the greatest common divisor of window "
+                                        "and step." % MAX_SEGMENT_BLOCKS)
+        return cleaned_data
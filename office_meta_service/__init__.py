@@ -1,5 +1,4 @@
 import binascii
-import hashlib
 
 from django.template.loader import render_to_string
 
@@ -7,15 +6,19 @@ from crits.services.core import Service, ServiceConfigError
 from crits.samples.handlers import handle_file
 
 from office_meta import OfficeParser
+from ooxml_meta import OOXMLParser
 from . import forms
 
 class OfficeMetaService(Service):
     """
     Parses meta data from Office documents using a custom parser.
+
+    Both OLE compound documents and Office Open XML (.docx, .xlsx, .pptx)
+    documents are supported.
     """
 
     name = "office_meta"
-    version = '1.0.2'
+    version = '1.3.0'
     supported_types = ['Sample']
     description = "Parses metadata from Office documents."
 
@@ -32,7 +35,7 @@ class OfficeMetaService(Service):
             data = obj.filedata.read()
             # Need to reset the read pointer.
             obj.filedata.seek(0)
-            if data.startswith(office_magic):
+            if data.startswith(office_magic) or OOXMLParser.is_ooxml(data):
                 return
         raise ServiceConfigError("Not a valid office document.")
 
@@ -50,7 +53,11 @@ class OfficeMetaService(Service):
         return forms.OfficeMetaRunForm(config)
 
     def run(self, obj, config):
-        oparser = OfficeParser(obj.filedata.read())
+        data = obj.filedata.read()
+        if data.startswith(OOXMLParser.zip_magic):
+            self.run_ooxml(data)
+            return
+        oparser = OfficeParser(data)
         oparser.parse_office_doc()
         added_files = []
         if not oparser.office_header.get('maj_ver'):
@@ -67,15 +74,15 @@ class OfficeMetaService(Service):
             }
             name = curr_dir['norm_name'].decode('ascii', errors='ignore')
             self._add_result('directory', name, result)
-            if config.get('save_streams', 0) == 1 and 'data' in curr_dir:
-                handle_file(name, curr_dir['data'], obj.source,
+            # streams are only read out of the document when they are saved
+            if config.get('save_streams', 0) == 1 and 'md5' in curr_dir:
+                handle_file(name, curr_dir.read(), obj.source,
                             related_id=str(obj.id),
                             campaign=obj.campaign,
                             method=self.name,
                             relationship='Extracted_From',
                             user=self.current_task.username)
-                stream_md5 = hashlib.md5(curr_dir['data']).hexdigest()
-                added_files.append((name, stream_md5))
+                added_files.append((name, curr_dir['md5']))
         for prop_list in oparser.properties:
             for prop in prop_list['property_list']:
                 prop_summary = oparser.summary_mapping.get(binascii.unhexlify(prop['clsid']), None)
@@ -90,5 +97,19 @@ class OfficeMetaService(Service):
         for f in added_files:
             self._add_result("file_added", f[0], {'md5': f[1]})
 
+    def run_ooxml(self, data):
+        oparser = OOXMLParser(data)
+        oparser.parse_ooxml_doc()
+        for error in oparser.errors:
+            self._error(error)
+        for prop_list in oparser.properties:
+            for item in prop_list['properties']:
+                result = {
+                    'name':             item['name'],
+                    'value':            item.get('date', item['value']),
+                    'result':           item['result'],
+                }
+                self._add_result('doc_meta', prop_list['name'], result)
+
     def _parse_error(self, item, e):
         self._error("Error parsing %s (%s): %s" % (item, e.__class__.__name__, e))
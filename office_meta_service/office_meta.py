@@ -6,7 +6,48 @@ import binascii
 import struct
 import pprint
 
-sys.setrecursionlimit(10000)
+# Special sector numbers in the FAT.
+FREESECT = 0xffffffff
+ENDOFCHAIN = 0xfffffffe
+FATSECT = 0xfffffffd
+
+def sector_runs(sectors):
+    """
+    Yield (first, last + 1) for each run of consecutive sector numbers.
+    """
+    i = 0
+    while i < len(sectors):
+        start = sectors[i]
+        i += 1
+        while i < len(sectors) and sectors[i] == sectors[i - 1] + 1:
+            i += 1
+        yield (start, sectors[i - 1] + 1)
+
+class DirectoryEntry(dict):
+    """
+    A directory entry which keeps the sector chain of its stream instead of
+    the stream data. The data is read from the document on demand with
+    read(), or piece by piece with chunks().
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, *args, **kwargs):
+        super(DirectoryEntry, self).__init__(*args, **kwargs)
+        self.source = ''
+        self.sectors = array.array('I')
+        self.sector_size = 512
+        self.base = 0
+
+    def chunks(self):
+        view = memoryview(self.source)
+        for (start, end) in sector_runs(self.sectors):
+            low = (start + self.base) * self.sector_size
+            high = min((end + self.base) * self.sector_size, len(self.source))
+            for offset in xrange(low, high, self.chunk_size):
+                yield view[offset:min(offset + self.chunk_size, high)].tobytes()
+
+    def read(self):
+        return ''.join(self.chunks())
 
 class OfficeParser(object):
     summary_mapping = {
@@ -68,42 +109,58 @@ class OfficeParser(object):
         self.mini_fat_data = ''
         self.sector_size = 512
 
+    def walk_chain(self, sector, table):
+        """
+        Return an array of the sectors in the chain starting at sector.
+
+        The chain ends at ENDOFCHAIN, at a sector outside of the table or
+        at a sector which points to itself (which is left out). A chain
+        which loops back on itself is cut before the first repeated sector.
+        """
+        sectors = array.array('I')
+        seen = set()
+        while sector not in (FREESECT, ENDOFCHAIN) and sector < len(table) and sector not in seen:
+            if self.verbose and table is self.fat_table:
+                print "request sector %d - len %d" % (sector, len(table))
+            next_sector = table[sector]
+            if next_sector == sector:
+                break
+            sectors.append(sector)
+            seen.add(sector)
+            sector = next_sector
+        return sectors
+
+    @staticmethod
+    def join_sectors(data, sectors, size, base=0):
+        """
+        Return the data of the given sectors, where sector n starts at
+        (n + base) * size. Runs of consecutive sectors are sliced at once.
+        """
+        view = memoryview(data)
+        return ''.join(view[(start + base) * size:(end + base) * size].tobytes()
+                       for (start, end) in sector_runs(sectors))
+
     def get_mini_fat_chain(self, sector):
-        if sector in [0xffffffff, 0xfffffffe]:
-            return ''
-        elif sector < len(self.mini_fat_table):
-            if self.mini_fat_table[sector] == 0xfffffffe:
-                return self.get_mini_fat_sector(sector)
-            elif sector != self.mini_fat_table[sector]:
-                data = self.get_mini_fat_sector(sector)
-                return data + self.get_mini_fat_chain(self.mini_fat_table[sector])
-        return ''
+        sectors = self.walk_chain(sector, self.mini_fat_table)
+        return self.join_sectors(self.mini_fat_data, sectors, 64)
 
     def get_mini_fat_sector(self, sector):
         return self.mini_fat_data[(sector) * 64 : (sector + 1) * 64]
 
     def get_fat_chain(self, sector):
-        if sector in [0xffffffff, 0xfffffffe]:
-            return ''
-        elif sector < len(self.fat_table):
-            if self.verbose:
-                print "request sector %d - len %d" % (sector, len(self.fat_table))
-            if self.fat_table[sector] == 0xfffffffe:
-                return self.get_fat_sector(sector)
-            elif sector != self.fat_table[sector]:
-                data = self.get_fat_sector(sector)
-                return data + self.get_fat_chain(self.fat_table[sector])
-        return ''
+        sectors = self.walk_chain(sector, self.fat_table)
+        # Sector 0 starts after the header, which is one sector long.
+        return self.join_sectors(self.data, sectors, self.sector_size, 1)
+
+    def set_fat_chain(self, entry):
+        entry.source = self.data
+        entry.sectors = self.walk_chain(entry['start_sect'], self.fat_table)
+        entry.sector_size = self.sector_size
+        # Sector 0 starts after the header, which is one sector long.
+        entry.base = 1
 
     def get_mini_fat_sector_chain(self, sector):
-        if sector in [0xffffffff, 0xfffffffe, 0xfffffffd]:
-            return []
-        elif sector < len(self.fat_table):
-            if self.fat_table[sector] == 0xfffffffe:
-                return [sector]
-            elif sector != self.fat_table[sector]:
-                return [sector] + self.get_mini_fat_sector_chain(self.fat_table[sector])
-        return []
+        return self.walk_chain(sector, self.fat_table).tolist()
 
     def get_fat_sector(self, sector):
         return self.data[(sector + 1) * self.sector_size : (sector+2) * self.sector_size]
@@ -275,11 +332,13 @@ class OfficeParser(object):
         return {}
 
     def parse_directory(self, data):
+        for offset in xrange(0, len(data) - 127, 128):
+            self.parse_directory_entry(data[offset:offset + 128])
+        return {}
+
+    def parse_directory_entry(self, data):
         if len(data) >= 128:
-            #if data[:8] == '\x00\x10\x00\x00\x00\x00\x00\x00': 
-            #    print "trucating first 8 bytes"
-            #    self.parse_directory(data[8:])
-            entry = {
+            entry = DirectoryEntry({
                 'name':             data[:64],
                 'name_len':         struct.unpack('H', data[64:66])[0],
                 'object_type':      struct.unpack('B', data[66])[0],
@@ -293,7 +352,7 @@ class OfficeParser(object):
                 'modify_time':      struct.unpack('Q', data[108:116])[0],
                 'start_sect':       struct.unpack('I', data[116:120])[0],
                 'stream_size':      struct.unpack('Q', data[120:128])[0],
-            }
+            })
             # /version 3 limits this field to 32 bits
             if self.office_header['maj_ver'] == 3:
                 entry['stream_size'] = entry['stream_size'] & 0x7fffffff
@@ -306,33 +365,45 @@ class OfficeParser(object):
                     norm_name = norm_name[1:]
             entry['norm_name'] = norm_name
             entry['result'] = norm_name
-            # fetch any directory data if available
+            # find the sectors of any directory data
             if entry['object_type'] == 0x05:
-                dir_data = self.get_fat_chain(entry['start_sect'])
-                self.mini_fat_data = dir_data
+                self.set_fat_chain(entry)
+                # the root entry holds the mini stream, which is needed now
+                self.mini_fat_data = entry.read()
             elif entry['stream_size'] > 0 and entry['stream_size'] < self.office_header['mini_stream_cutoff']:
-                dir_data = self.get_mini_fat_chain(entry['start_sect'])
+                entry.source = self.mini_fat_data
+                entry.sectors = self.walk_chain(entry['start_sect'], self.mini_fat_table)
+                entry.sector_size = 64
             elif entry['stream_size'] >= self.office_header['mini_stream_cutoff']:
-                dir_data = self.get_fat_chain(entry['start_sect'])
-            else:
-                 dir_data = ''
+                self.set_fat_chain(entry)
+            # hash the data and look for property sets a piece at a time
+            md5 = hashlib.md5()
+            size = 0
+            found = set()
+            tail = ''
+            for piece in entry.chunks():
+                md5.update(piece)
+                size += len(piece)
+                edge = tail + piece[:15]
+                for clsid in self.summary_mapping.keys():
+                    if clsid in piece or clsid in edge:
+                        found.add(clsid)
+                tail = (tail + piece[-15:])[-15:]
             if self.verbose:
-                print "[+] got %d data from %s" % (len(dir_data), entry['result'])
+                print "[+] got %d data from %s" % (size, entry['result'])
             # check the directory specific content and parse
-            if entry['object_type'] in [0,2] and len(dir_data) > 0:
+            if entry['object_type'] in [0,2] and found:
+                dir_data = entry.read()
                 for clsid in self.summary_mapping.keys():
-                    if clsid in dir_data:
+                    if clsid in found:
                         self.properties.append(self.parse_summary_information(dir_data, clsid))
                         if self.verbose:
                             print self.properties
-            if len(dir_data) > 0:
-                entry['md5'] = hashlib.md5(dir_data).hexdigest()
-                entry['data'] = dir_data
+            if size > 0:
+                entry['md5'] = md5.hexdigest()
             if self.verbose:
                 pprint.pprint(entry)
             self.directory.append(entry) 
-            self.parse_directory(data[128:])
-        return {}
 
     def pretty_print(self):
         print "\nDocument Summary\n" + "-" * 40
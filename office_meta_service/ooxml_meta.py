@@ -0,0 +1,210 @@
+import time
+import zipfile
+import zlib
+import cStringIO
+import xml.etree.cElementTree as ElementTree
+
+class MemberError(Exception):
+    pass
+
+class MemberReader(object):
+    """
+    File object for iterparse over a zip member. It stops at limit bytes,
+    whatever size the member claims to be, and refuses DTDs, since entity
+    declarations can expand to far more than the member size.
+    """
+    def __init__(self, member, limit):
+        self.member = member
+        self.limit = limit
+        self.size = 0
+        self.tail = ''
+
+    def read(self, size=-1):
+        data = self.member.read(size)
+        self.size += len(data)
+        if self.size > self.limit:
+            raise MemberError("member is larger than %d bytes" % self.limit)
+        if '<!DOCTYPE' in self.tail + data:
+            raise MemberError("DTD found in XML member")
+        self.tail = data[-8:]
+        return data
+
+class OOXMLParser(object):
+    """
+    Parses the document properties of Office Open XML (.docx, .xlsx, .pptx)
+    documents. Only the property parts are inflated, the rest of the archive
+    is never read. Names match the OLE property names of OfficeParser where
+    there is one.
+    """
+    zip_magic = "PK\x03\x04"
+    content_types = "[Content_Types].xml"
+    # Property parts larger than this are not parsed.
+    max_member_size = 10 * 1024 * 1024
+    parts = [
+        ('docProps/core.xml', 'SummaryInformation'),
+        ('docProps/app.xml', 'DocumentSummaryInformation'),
+        ('docProps/custom.xml', 'CustomProperties'),
+    ]
+    core_mapping = {
+        'title':                'Title',
+        'subject':              'Subject',
+        'creator':              'Author',
+        'keywords':             'Keywords',
+        'description':          'Comments',
+        'lastModifiedBy':       'Last Saved By',
+        'revision':             'Revision Number',
+        'lastPrinted':          'Last printed Date',
+        'created':              'Creation Date',
+        'modified':             'Last Saved Date',
+        'category':             'Category',
+        'contentStatus':        'Content Status',
+        'identifier':           'Identifier',
+        'language':             'Language',
+        'version':              'Version',
+    }
+    app_mapping = {
+        'Template':             'Template',
+        'TotalTime':            'Total Edititing Time',
+        'Pages':                'Number of Pages',
+        'Words':                'Number of Words',
+        'Characters':           'Number of Characters',
+        'Application':          'Name of Creating Appliction',
+        'DocSecurity':          'Security',
+        'Lines':                'Number of Lines',
+        'Paragraphs':           'Number of Paragraphs',
+        'Slides':               'Number of Slides',
+        'Notes':                'Number of Notes',
+        'HiddenSlides':         'Number of Hidden Slides',
+        'MMClips':              'MMClips',
+        'ScaleCrop':            'ScaleCrops',
+        'Manager':              'Manager',
+        'Company':              'Company',
+        'LinksUpToDate':        'Links up to date',
+    }
+    date_fields = ['created', 'modified', 'lastPrinted']
+
+    def __init__(self, data, verbose=False):
+        self.data = data
+        self.verbose = verbose
+        self.properties = []
+        self.errors = []
+
+    @classmethod
+    def is_ooxml(cls, data):
+        if not data.startswith(cls.zip_magic):
+            return False
+        try:
+            archive = zipfile.ZipFile(cStringIO.StringIO(data))
+        except (zipfile.BadZipfile, zipfile.LargeZipFile):
+            return False
+        return cls.content_types in archive.NameToInfo
+
+    @staticmethod
+    def local_name(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    def date_string(self, value):
+        try:
+            return time.strftime("%Y/%m/%d %H:%M:%S", time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S"))
+        except ValueError:
+            return None
+
+    def make_property(self, name, value, key=None):
+        prop = {
+            'name':     name,
+            'value':    value,
+        }
+        if key in self.date_fields:
+            date = self.date_string(value)
+            if date:
+                prop['date'] = date
+        prop['result'] = "%s: %s" % (name, prop.get('date', value))
+        return prop
+
+    def iter_elements(self, member):
+        """
+        Yield (depth, element) for every element once it has been parsed,
+        where the root element has depth 0.
+        """
+        depth = 0
+        for (event, elem) in ElementTree.iterparse(MemberReader(member, self.max_member_size), events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            yield (depth, elem)
+
+    def parse_core(self, member):
+        properties = []
+        for (depth, elem) in self.iter_elements(member):
+            if depth == 1:
+                key = self.local_name(elem.tag)
+                name = self.core_mapping.get(key, key)
+                properties.append(self.make_property(name, (elem.text or '').strip(), key))
+                elem.clear()
+        return properties
+
+    def parse_app(self, member):
+        properties = []
+        for (depth, elem) in self.iter_elements(member):
+            if depth == 1:
+                # HeadingPairs and TitlesOfParts are vectors, skip them
+                if len(elem) == 0:
+                    key = self.local_name(elem.tag)
+                    name = self.app_mapping.get(key, key)
+                    properties.append(self.make_property(name, (elem.text or '').strip(), key))
+                elem.clear()
+        return properties
+
+    def parse_custom(self, member):
+        properties = []
+        for (depth, elem) in self.iter_elements(member):
+            if depth == 1:
+                name = elem.get('name', 'Unknown')
+                values = [(child.text or '').strip() for child in elem]
+                properties.append(self.make_property(name, values[0] if values else ''))
+                elem.clear()
+        return properties
+
+    def parse_ooxml_doc(self):
+        try:
+            archive = zipfile.ZipFile(cStringIO.StringIO(self.data))
+        except (zipfile.BadZipfile, zipfile.LargeZipFile), e:
+            self.errors.append("Could not open zip file: %s" % e)
+            return None
+        parsers = {
+            'SummaryInformation':           self.parse_core,
+            'DocumentSummaryInformation':   self.parse_app,
+            'CustomProperties':             self.parse_custom,
+        }
+        for (part, name) in self.parts:
+            info = archive.NameToInfo.get(part)
+            if info is None:
+                continue
+            if info.file_size > self.max_member_size:
+                self.errors.append("%s is too large (%d bytes)" % (part, info.file_size))
+                continue
+            try:
+                member = archive.open(info)
+                properties = parsers[name](member)
+            except (zipfile.BadZipfile, zlib.error, ElementTree.ParseError, MemberError,
+                    RuntimeError, NotImplementedError, IOError), e:
+                # RuntimeError and NotImplementedError are raised for encrypted
+                # members and unsupported compression methods
+                self.errors.append("Could not parse %s: %s" % (part, e))
+                continue
+            if self.verbose:
+                print "[+] %d properties in %s" % (len(properties), part)
+            self.properties.append({
+                'name':         name,
+                'properties':   properties,
+            })
+        return self.properties
+
+    def pretty_print(self):
+        print "\nProperties\n" + "-" * 40
+        for prop_list in self.properties:
+            print "\n\t%s" % prop_list['name']
+            for item in prop_list['properties']:
+                line = u"%50s - %40s" % (item['name'], item.get('date', item['value']))
+                print line.encode('utf-8')
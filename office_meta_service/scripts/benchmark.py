@@ -0,0 +1,141 @@
+"""
+Time OfficeParser on a directory of OLE documents (.doc, .xls, .ppt, ...).
+
+Example Usage:
+    python manage.py runscript office_meta_service benchmark -- -d /path/to/docs
+    python manage.py runscript office_meta_service benchmark -- -s 6 -F
+
+Without a directory, a synthetic document with one stream of the given
+number of MB is built. -F interleaves the sectors of its streams so every
+chain is fragmented. Nothing is read from or written to the database.
+"""
+
+import os
+import struct
+import time
+from optparse import OptionParser
+
+from crits.core.basescript import CRITsBaseScript
+from office_meta_service.office_meta import OfficeParser, FREESECT, ENDOFCHAIN, FATSECT
+
+SECTOR_SIZE = 512
+
+def directory_entry(name, object_type, start_sect, stream_size, child=FREESECT):
+    name = name.encode('utf-16le') + '\x00\x00'
+    return struct.pack('<64sHBBIII16sIQQIQ', name, len(name), object_type, 1,
+                       FREESECT, FREESECT, child, '\x00' * 16, 0, 0, 0,
+                       start_sect, stream_size)
+
+def build_document(stream_sizes, fragmented=False):
+    """
+    Return a version 3 compound file with one stream per size. Streams are
+    stored in the FAT (sizes below 4096 bytes are rounded up).
+    """
+
+    stream_sizes = [max(size, 4096) for size in stream_sizes]
+    counts = [(size + SECTOR_SIZE - 1) / SECTOR_SIZE for size in stream_sizes]
+    # Sector numbers of every stream, either in one run or interleaved.
+    chains = [[] for size in stream_sizes]
+    sector = 0
+    if fragmented:
+        for i in range(max(counts)):
+            for (chain, count) in zip(chains, counts):
+                if i < count:
+                    chain.append(sector)
+                    sector += 1
+    else:
+        for (chain, count) in zip(chains, counts):
+            chain.extend(range(sector, sector + count))
+            sector += count
+    entries = [directory_entry(u'Root Entry', 5, ENDOFCHAIN, 0, 1 if chains else FREESECT)]
+    for (i, (chain, size)) in enumerate(zip(chains, stream_sizes)):
+        entries.append(directory_entry(u'Stream%d' % i, 2, chain[0], size))
+    directory = ''.join(entries)
+    dir_count = (len(directory) + SECTOR_SIZE - 1) / SECTOR_SIZE
+    dir_chain = range(sector, sector + dir_count)
+    sector += dir_count
+    fat_count = 1
+    while (sector + fat_count) > fat_count * (SECTOR_SIZE / 4):
+        fat_count += 1
+    if fat_count > 109:
+        raise ValueError("document too large for the header DIFAT")
+    fat_chain = range(sector, sector + fat_count)
+
+    fat = [FREESECT] * (fat_count * (SECTOR_SIZE / 4))
+    for chain in chains + [dir_chain]:
+        for (a, b) in zip(chain, chain[1:]):
+            fat[a] = b
+        fat[chain[-1]] = ENDOFCHAIN
+    for fat_sector in fat_chain:
+        fat[fat_sector] = FATSECT
+
+    header = struct.pack('<8s16sHHHHH6sIIIIIIIII', OfficeParser.office_magic,
+                         '\x00' * 16, 0x3e, 3, 0xfffe, 9, 6, '\x00' * 6, 0,
+                         fat_count, dir_chain[0], 0, 4096, ENDOFCHAIN, 0,
+                         ENDOFCHAIN, 0)
+    difat = fat_chain + [FREESECT] * (109 - fat_count)
+    header += struct.pack('<109I', *difat)
+
+    sectors = [None] * (sector + fat_count)
+    for (i, (chain, size)) in enumerate(zip(chains, stream_sizes)):
+        body = (chr(0x41 + i % 26) * size).ljust(len(chain) * SECTOR_SIZE, '\x00')
+        for (j, number) in enumerate(chain):
+            sectors[number] = body[j * SECTOR_SIZE:(j + 1) * SECTOR_SIZE]
+    directory = directory.ljust(dir_count * SECTOR_SIZE, '\x00')
+    for (j, number) in enumerate(dir_chain):
+        sectors[number] = directory[j * SECTOR_SIZE:(j + 1) * SECTOR_SIZE]
+    fat_data = struct.pack('<%dI' % len(fat), *fat)
+    for (j, number) in enumerate(fat_chain):
+        sectors[number] = fat_data[j * SECTOR_SIZE:(j + 1) * SECTOR_SIZE]
+    return header + ''.join(sectors)
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def time_parse(self, data, rounds):
+        best = None
+        for i in range(rounds):
+            start = time.time()
+            oparser = OfficeParser(data)
+            oparser.parse_office_doc()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return (best, len(oparser.directory))
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-d", "--directory", action="store", dest="directory",
+                type="string", help="directory of OLE documents")
+        parser.add_option("-s", "--size", action="store", dest="size",
+                type="int", default=4, help="MB of the synthetic stream")
+        parser.add_option("-F", "--fragmented", action="store_true", dest="fragmented",
+                default=False, help="fragment the synthetic streams")
+        parser.add_option("-r", "--rounds", action="store", dest="rounds",
+                type="int", default=5, help="rounds per document, best is reported")
+        (opts, args) = parser.parse_args(argv)
+
+        documents = []
+        if opts.directory:
+            for root, dirs, names in os.walk(opts.directory):
+                for name in names:
+                    path = os.path.join(root, name)
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    if data.startswith(OfficeParser.office_magic):
+                        documents.append((path, data))
+        else:
+            sizes = [opts.size * 1024 * 1024, 64 * 1024, 8 * 1024]
+            documents.append(("synthetic", build_document(sizes, opts.fragmented)))
+
+        total_bytes = 0
+        total_time = 0.0
+        for (name, data) in documents:
+            (elapsed, entries) = self.time_parse(data, opts.rounds)
+            total_bytes += len(data)
+            total_time += elapsed
+            print "[+] %s: %d bytes, %d entries, %.4f seconds" % (name, len(data), entries, elapsed)
+        if total_time:
+            print "[+] %d documents, %.1f MB/s" % (len(documents),
+                                                  total_bytes / total_time / (1024 * 1024))
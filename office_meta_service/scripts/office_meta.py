@@ -4,6 +4,7 @@ from django.core.mail import send_mail
 from crits.core.mongo_tools import get_file
 from crits.core.basescript import CRITsBaseScript
 from office_meta_service.office_meta import OfficeParser
+from office_meta_service.ooxml_meta import OOXMLParser
 
 class CRITsScript(CRITsBaseScript):
     def __init__(self, username=None):
@@ -29,6 +30,12 @@ class CRITsScript(CRITsBaseScript):
             fin.close()
         if opts.verbose:
             print "[+] parsing %d bytes" % len(data)
-        if len(data) > 512:
+        if data.startswith(OOXMLParser.zip_magic):
+            oparser = OOXMLParser(data, opts.verbose)
+            oparser.parse_ooxml_doc()
+            for error in oparser.errors:
+                print "[-] %s" % error
+            oparser.pretty_print()
+        elif len(data) > 512:
             oparser = OfficeParser(data, opts.verbose)
             oparser.parse_office_doc()
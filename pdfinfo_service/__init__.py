@@ -1,13 +1,21 @@
 import hashlib
 import logging
 
+from django.template.loader import render_to_string
+
 from crits.services.core import Service, ServiceConfigError
 
+from . import forms
+from .stream_cache import stream_cache
+
 import pdfparser
 import pdfid
+import pdfkeywords
+import pdftokenizer
 import math
 import re
 import json
+from xml.sax.saxutils import escape
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +29,7 @@ class PDFInfoService(Service):
     """
 
     name = "pdfinfo"
-    version = '1.2.0'
+    version = '1.4.0'
     description = "Extract information from PDF files."
     supported_types = ['Sample']
 
@@ -31,6 +39,34 @@ class PDFInfoService(Service):
         if not obj.is_pdf():
             raise ServiceConfigError("Not a valid PDF.")
 
+    @staticmethod
+    def get_config(existing_config):
+        # Generate default config from form and initial values.
+        config = {}
+        fields = forms.PDFInfoConfigForm().fields
+        for name, field in fields.iteritems():
+            config[name] = field.initial
+
+        # If there is a config in the database, use values from that.
+        if existing_config:
+            for key, value in existing_config.iteritems():
+                config[key] = value
+        return config
+
+    @staticmethod
+    def get_config_details(config):
+        return {'Stream cache': config['cachedir'],
+                'Stream cache size': config['cache_size']}
+
+    @classmethod
+    def generate_config_form(self, config):
+        html = render_to_string('services_config_form.html',
+                                {'name': self.name,
+                                 'form': forms.PDFInfoConfigForm(initial=config),
+                                 'config_error': None})
+        form = forms.PDFInfoConfigForm
+        return form, html
+
     def H(self, data):
         """
         Calculate entropy for provided data
@@ -55,14 +91,40 @@ class PDFInfoService(Service):
         else:
             return "0.0"
 
-    def run_pdfid(self, data):
+    def run_pdfid(self, data, fast=True):
         """
         Uses PDFid to generate stats for the PDF
         - Display keyword matches
+
+        fast counts the same keywords with pdfkeywords instead of running
+        PDFiD and converting its XML output. The results are stored exactly
+        as the PDFiD path below stores them.
         """
+        if fast:
+            counts = pdfkeywords.count_keywords(data)
+            if counts == None:
+                self._info("PDFiD: no PDF header found")
+                return
+            # PDFiD keeps the whole file in its Filename attribute, so
+            # PDFiD2JSON only succeeds when the file is valid UTF-8.
+            # Otherwise the counts are read from the XML as strings and the
+            # names stay XML escaped.
+            try:
+                data.decode('utf-8')
+                xml_json_success = True
+            except UnicodeDecodeError:
+                xml_json_success = False
+            for keyword in pdfkeywords.KEYWORDS + (pdfkeywords.COLORS,):
+                count = counts[keyword]['count']
+                if xml_json_success:
+                    self._add_result('pdfid', keyword, {'count': count})
+                else:
+                    self._add_result('pdfid', escape(keyword), {'count': str(count)})
+            return
+
         xml_json_success = True
 
-        xml_data = pdfid.PDFiD(data)
+        xml_data = pdfid.PDFiD(data, binaryFile=pdftokenizer.cBufferBinaryFile)
         try:
             json_data = pdfid.PDFiD2JSON(xml_data,'')
             pdfid_dict = json.loads(json_data)[0]
@@ -79,145 +141,178 @@ class PDFInfoService(Service):
             for count, item in re.findall(r'<Keyword\sCount="([^\"]+)"[^>]+Name=\"([^\"]+)\"',xml_data.toxml()):
                 self._add_result('pdfid', item, {'count':count})
 
-    def object_search(self, data, search_size=100):
+    # References and tags of interest found by object_search. It is
+    # important that OBJECTS_STR definitions do not detect objects found
+    # with OBJECTS_REGEX definitions.
+    OBJECTS_REGEX = [('js', re.compile(r'\/JavaScript\s(\d+)\s\d+\sR')),
+                     ('js', re.compile(r'\/JS\s(\d+)\s\d+\sR')),
+                     ('file', re.compile(r'\/F\s(\d+)\s\d+\sR'))]
+
+    OBJECTS_STR = [('js', '/JavaScript\n'),
+                   ('js', '/JavaScript\r\n'),
+                   ('js', '/JS\n'),
+                   ('js', '/JS\r\n'),
+                   ('file', '/F\n'),
+                   ('file', '/F\r\n')]
+
+    def _search_object(self, pdf_object, rawContent, objects, search_size=100):
         """
-        Locate objects and references of interest
-        @return dictionary containing object types and object id's
-        - Use regex and strings to locate PDF tags of interest
-
-        Note: It is important that objects_str definitions do 
-            not detect objects found with objects_regex defs.
+        Record the object id's of interest referenced by or found within
+        a single PDF object in objects.
         """
-        oPDFParser = pdfparser.cPDFParser(data)
-        done = False 
-        objects = {}
-        objects_regex = [(r'js', r'\/JavaScript\s(\d+)\s\d+\sR'),
-                        (r'js', r'\/JS\s(\d+)\s\d+\sR'),
-                        (r'file', r'\/F\s(\d+)\s\d+\sR')]
-
-        objects_str = [(r'js', '/JavaScript\n'),
-                        (r'js', '/JavaScript\r\n'),
-                        (r'js', '/JS\n'),
-                        (r'js', '/JS\r\n'),
-                        (r'file', '/F\n'),
-                        (r'file', '/F\r\n')]
-
-        #Walk the PDF objects
-        while done == False:
+        #See if this PDF object has references to items of interest
+        pdf_references = pdf_object.GetReferences()
+        if pdf_references:
+            #Match getReferences() with OBJECTS_REGEX results
+            for item in self.OBJECTS_REGEX:
+                matches = item[1].findall(rawContent[:search_size])
+                for match in matches:
+                    for ref in pdf_references:
+                        #Record found items
+                        if match == ref[0]:
+                            objects.setdefault(item[0], []).append(match)
+        #Find items within the current object.
+        for item in self.OBJECTS_STR:
+            if pdf_object.Contains(item[1]):
+                objects.setdefault(item[0], []).append(str(pdf_object.id))
+
+    def _walk_objects(self, data):
+        """
+        Yield every indirect object in the PDF along with its formatted
+        content.
+        """
+        oPDFParser = pdfparser.cPDFParser(data, tokenizer=pdftokenizer.cPDFStreamSkipTokenizer)
+        while True:
             try:
                 pdf_object = oPDFParser.GetObject()
             except Exception as e:
                 pdf_object = None
 
-            if pdf_object != None:
-                if pdf_object.type in [pdfparser.PDF_ELEMENT_INDIRECT_OBJECT]:
-                    #See if this PDF object has references to items of interest
-                    rawContent = pdfparser.FormatOutput(pdf_object.content, True)
-                    pdf_references = pdf_object.GetReferences()
-                    if pdf_references:
-                        #Match getReferences() with objects_regex results
-                        for item in objects_regex:
-                            matches = re.findall(item[1],rawContent[:search_size])
-                            for match in matches:
-                                for ref in pdf_references:
-                                    #Record found items
-                                    if match == ref[0]:
-                                        if objects.get(item[0]):
-                                            objects[item[0]].append(match)
-                                        else:
-                                            objects[item[0]] = [match]
-                    #Find items within the current object.
-                    for item in objects_str:
-                        if pdf_object.Contains(item[1]):
-                            if objects.get(item[0]):
-                                objects[item[0]].append(str(pdf_object.id))
-                            else:
-                                objects[item[0]] = [str(pdf_object.id)]
-            else:
-                done = True
+            if pdf_object == None:
+                self._debug("%d streams read by /Length, %d scanned" % (
+                    oPDFParser.oPDFTokenizer.streamsSkipped,
+                    oPDFParser.oPDFTokenizer.streamsScanned))
+                return
+            if pdf_object.type in [pdfparser.PDF_ELEMENT_INDIRECT_OBJECT]:
+                yield (pdf_object, pdfparser.FormatOutput(pdf_object.content, True))
+
+    def object_search(self, data, search_size=100):
+        """
+        Locate objects and references of interest
+        @return dictionary containing object types and object id's
+        - Use regex and strings to locate PDF tags of interest
+        """
+        objects = {}
+        for pdf_object, rawContent in self._walk_objects(data):
+            self._search_object(pdf_object, rawContent, objects, search_size)
         return objects
 
-    def run_pdfparser(self, data):
+    def _stream_md5(self, pdf_object, rawContent, cachedir=None, cache_size=0):
+        """
+        Return the MD5 of the decompressed stream of pdf_object and whether
+        it came from the stream cache.
+        """
+        (rawStream, filters) = pdf_object.RawStream()
+
+        #No endstream, so there is no actual stream data
+        if rawStream is None:
+            #Inspect pdf_object.content and extract raw stream
+            streamContent = rawContent
+            stream_start = streamContent.find('stream') + len('stream')
+            stream_end = streamContent.rfind('endstream')
+            if stream_start >= 0 and stream_end > 0:
+                streamContent = streamContent[stream_start:stream_end]
+            return (hashlib.md5(streamContent).hexdigest(), False)
+
+        key = stream_cache.key(rawStream, filters)
+        stream_md5_digest = stream_cache.get(key, cachedir)
+        if stream_md5_digest is not None:
+            return (stream_md5_digest, True)
+
+        try:
+            #decompress stream using codec
+            streamContent = pdf_object.Decompress(rawStream, filters)
+        except Exception as e:
+            streamContent = "decompress failed."
+
+        if "decompress failed." in streamContent[:50]:
+            #Provide raw stream data
+            streamContent = rawStream
+
+        stream_md5_digest = hashlib.md5(streamContent).hexdigest()
+        stream_cache.put(key, stream_md5_digest, cachedir, cache_size)
+        return (stream_md5_digest, False)
+
+    def run_pdfparser(self, data, cachedir=None, cache_size=0):
         """
         Uses pdf-parser to get information for each object.
-        """        
-        oPDFParser = pdfparser.cPDFParser(data)
-        done = False
+
+        The PDF is walked once. Objects of interest may be referenced by
+        objects later in the file, so the content of each object is only
+        filled in once the walk is done.
+        """
         found_objects = {}
+        results = []
+        streams = 0
+        cached_streams = 0
 
         #Walk the PDF and inspect PDF objects
-        found_objects = self.object_search(data)
-
-        while done == False:
-            try:
-                pdf_object = oPDFParser.GetObject()
-            except Exception as e:
-                pdf_object = None
-
-            if pdf_object != None:
-                if pdf_object.type in [pdfparser.PDF_ELEMENT_INDIRECT_OBJECT]:
-                    #Get general information for this PDF object
-                    rawContent = pdfparser.FormatOutput(pdf_object.content, True)
-                    section_md5_digest = hashlib.md5(rawContent).hexdigest()
-                    section_entropy = self.H(rawContent)
-                    object_type = pdf_object.GetType()
-
-                    #Access data associated with this PDF object
-                    if pdf_object.ContainsStream():
-                        object_stream = True
-                        try:
-                            #decompress stream using codec
-                            streamContent = pdf_object.Stream() 
-                        except Exception as e:
-                            streamContent = "decompress failed."
-
-                        if "decompress failed." in streamContent[:50]:
-                            #Provide raw stream data
-                            streamContent = pdf_object.Stream('')
-
-                        #Stream returns list of object tags (not actual stream data)
-                        if type(streamContent) == list:
-                            streamContent = pdfparser.FormatOutput(pdf_object.content, True)
-                            #Inspect pdf_object.content and extract raw stream
-                            stream_start = streamContent.find('stream') + len('stream')
-                            stream_end = streamContent.rfind('endstream')
-                            if stream_start >= 0 and stream_end > 0:
-                                streamContent = streamContent[stream_start:stream_end]
-
-                        stream_md5_digest = hashlib.md5(streamContent).hexdigest()
-                    else:
-                        object_stream = False
-                        stream_md5_digest = ''
-
-                    #Collect references between this object and others
-                    object_references = []
-                    for reference in pdf_object.GetReferences():
-                        object_references.append(reference[0])
-                    object_references = ','.join(object_references)
-
-                    #Get results from the object searching
-                    object_content = []
-                    if found_objects.get('js'):
-                        if str(pdf_object.id) in found_objects.get('js'):
-                            object_content.append('JavaScript')
-                    if found_objects.get('file'):
-                        if str(pdf_object.id) in found_objects.get('file'):
-                            object_content.append('EmbeddedFile')
-
-                    result = {
-                            "obj_id":           pdf_object.id,
-                            "obj_version":      pdf_object.version,
-                            "size":             len(rawContent),
-                            "type":             object_type,
-                            "entropy":          section_entropy,
-                            "content":          ','.join(object_content),
-                            "x_refs":           object_references,
-                            "stream":           object_stream,
-                            "stream_md5":       stream_md5_digest,
-                    }
-                    self._add_result('pdf_parser', section_md5_digest, result)
+        for pdf_object, rawContent in self._walk_objects(data):
+            self._search_object(pdf_object, rawContent, found_objects)
+
+            #Get general information for this PDF object
+            section_md5_digest = hashlib.md5(rawContent).hexdigest()
+            section_entropy = self.H(rawContent)
+            object_type = pdf_object.GetType()
+
+            #Access data associated with this PDF object
+            if pdf_object.ContainsStream():
+                object_stream = True
+                (stream_md5_digest, cached) = self._stream_md5(pdf_object,
+                                                               rawContent,
+                                                               cachedir,
+                                                               cache_size)
+                streams += 1
+                if cached:
+                    cached_streams += 1
             else:
-                done = True
+                object_stream = False
+                stream_md5_digest = ''
+
+            #Collect references between this object and others
+            object_references = []
+            for reference in pdf_object.GetReferences():
+                object_references.append(reference[0])
+            object_references = ','.join(object_references)
+
+            result = {
+                    "obj_id":           pdf_object.id,
+                    "obj_version":      pdf_object.version,
+                    "size":             len(rawContent),
+                    "type":             object_type,
+                    "entropy":          section_entropy,
+                    "x_refs":           object_references,
+                    "stream":           object_stream,
+                    "stream_md5":       stream_md5_digest,
+            }
+            results.append((section_md5_digest, result))
+
+        #Get results from the object searching
+        js_objects = set(found_objects.get('js', []))
+        file_objects = set(found_objects.get('file', []))
+        for section_md5_digest, result in results:
+            object_content = []
+            if str(result['obj_id']) in js_objects:
+                object_content.append('JavaScript')
+            if str(result['obj_id']) in file_objects:
+                object_content.append('EmbeddedFile')
+            result['content'] = ','.join(object_content)
+            self._add_result('pdf_parser', section_md5_digest, result)
+
+        if streams:
+            self._info("Stream cache: %d of %d streams cached (%.1f%%)" % (
+                cached_streams, streams, 100.0 * cached_streams / streams))
+        self._debug("Stream cache totals: %s" % stream_cache.stats())
 
     def run(self, obj, config):
         """
@@ -234,7 +329,7 @@ class PDFInfoService(Service):
 
         self.run_pdfid(data)
         self._notify()
-        self.run_pdfparser(data)
+        self.run_pdfparser(data, config.get('cachedir'), config.get('cache_size', 0))
 
     def _parse_error(self, item, e):
         self._error("Error parsing %s (%s): %s" % (item, e.__class__.__name__, e))
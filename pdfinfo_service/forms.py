@@ -0,0 +1,18 @@
+from django import forms
+
+class PDFInfoConfigForm(forms.Form):
+    error_css_class = 'error'
+    required_css_class = 'required'
+    cachedir = forms.CharField(required=False,
+                               label="Stream cache",
+                               initial='',
+                               widget=forms.TextInput(),
+                               help_text="Directory to store decompressed stream hashes in. Leave blank to only cache in memory.")
+    cache_size = forms.IntegerField(required=True,
+                                    label="Stream cache size",
+                                    initial=1000000,
+                                    min_value=0,
+                                    help_text="Most entries to keep in the stream cache directory. The least recently used are removed first. 0 means no limit.")
+
+    def __init__(self, *args, **kwargs):
+        super(PDFInfoConfigForm, self).__init__(*args, **kwargs)
@@ -348,7 +348,7 @@ def XMLAddAttribute(xmlDoc, name, value=None):
     if value != None:
         att.nodeValue = value
 
-def PDFiD(file, allNames=False, extraData=False, disarm=False, force=False):
+def PDFiD(file, allNames=False, extraData=False, disarm=False, force=False, binaryFile=None):
     """Example of XML output:
     <PDFiD ErrorOccured="False" ErrorMessage="" Filename="test.pdf" Header="%PDF-1.1" IsPDF="True" Version="0.0.4" Entropy="4.28">
             <Keywords>
@@ -417,7 +417,7 @@ def PDFiD(file, allNames=False, extraData=False, disarm=False, force=False):
     try:
         attIsPDF = xmlDoc.createAttribute('IsPDF')
         xmlDoc.documentElement.setAttributeNode(attIsPDF)
-        oBinaryFile = cBinaryFile(file)
+        oBinaryFile = (binaryFile or cBinaryFile)(file)
         if extraData:
             oPDFDate = cPDFDate()
             oEntropy = cEntropy()
@@ -0,0 +1,173 @@
+"""
+Count the PDFiD keywords in a PDF without running PDFiD.
+
+pdfid.PDFiD feeds the file through a state machine one byte at a time and
+returns the counts in an XML document. count_keywords() finds every
+occurrence of the same keywords, including names obfuscated with #xx hex
+codes such as /J#61vaScript, with one regular expression and then checks
+each occurrence is a whole word the same way PDFiD delimits words. It
+returns a plain dictionary with the same counts:
+
+    {'/JavaScript': {'count': 2, 'hexcodecount': 1}, ...}
+
+The scripts/compare_pdfid.py runscript compares both on a directory of PDFs.
+"""
+
+import re
+
+# Same keywords, in the same order, as pdfid.PDFiD.
+KEYWORDS = ('obj',
+            'endobj',
+            'stream',
+            'endstream',
+            'xref',
+            'trailer',
+            'startxref',
+            '/Page',
+            '/Encrypt',
+            '/ObjStm',
+            '/JS',
+            '/JavaScript',
+            '/AA',
+            '/OpenAction',
+            '/AcroForm',
+            '/JBIG2Decode',
+            '/RichMedia',
+            '/Launch',
+            '/EmbeddedFile',
+            '/XFA',
+           )
+
+# PDFiD also counts numbers larger than 2^24 (which is 26 in Python)
+# following a /Colors name, for CVE-2009-3459.
+COLORS = '/Colors > 2^24'
+
+_hex = '0123456789abcdefABCDEF'
+
+
+def _is_word(char):
+    return char.isalnum() and char < '\x80'
+
+
+def _is_hex(data, position):
+    return (position + 2 <= len(data) and data[position] in _hex and
+            data[position + 1] in _hex)
+
+
+def _name_pattern(name):
+    # A name can be preceded by / or by an invalid hex code (checked later)
+    # and every character of it can be written as #xx.
+    chars = []
+    for char in name:
+        code = '%02x' % ord(char)
+        if code[1].isalpha():
+            code = code[0] + '[' + code[1] + code[1].upper() + ']'
+        chars.append('(?:%s|#%s)' % (re.escape(char), code))
+    return '[/#]' + ''.join(chars)
+
+
+_names = [keyword for keyword in KEYWORDS if keyword.startswith('/')] + ['/Colors']
+_words = [keyword for keyword in KEYWORDS if not keyword.startswith('/')]
+# The lookahead on the possible first characters lets the regular
+# expression engine skip ahead instead of trying every alternative at every
+# position.
+_keyword_re = re.compile('(?=[/#%s])(?:%s)' % (
+    ''.join(sorted(set(word[0] for word in _words))),
+    '|'.join(['(%s)' % _name_pattern(name[1:]) for name in _names] +
+             ['(%s)' % word for word in _words])))
+_group_keywords = dict(enumerate(_names + _words, 1))
+
+
+def _slash(data, start, position):
+    """
+    Return True if the word starting at position is a name. In PDFiD this
+    is the case if the last character before it which is neither a word
+    character nor # is a /.
+    """
+
+    position -= 1
+    while position >= start and (_is_word(data[position]) or data[position] == '#'):
+        position -= 1
+    return position >= start and data[position] == '/'
+
+
+def _count_colors(data, position, slash):
+    """
+    Count the numbers larger than 26 PDFiD sees after a /Colors name
+    ending at position, up to the next name. slash is True while PDFiD is
+    reading a name.
+    """
+
+    count = 0
+    word = ''
+    end = len(data)
+    while position < end:
+        char = data[position]
+        if _is_word(char):
+            word += char
+        elif slash and char == '#':
+            if _is_hex(data, position + 1):
+                word += chr(int(data[position + 1:position + 3], 16))
+                position += 2
+            elif word:
+                return count
+        else:
+            if word.isdigit() and int(word) > 2^24:
+                count += 1
+            if word and slash:
+                return count
+            slash = (char == '/')
+            word = ''
+        position += 1
+    return count
+
+
+def count_keywords(data):
+    """
+    Return a dictionary of keyword to count and hexcode count, or None if
+    no PDF header is found in the first 1024 bytes.
+    """
+
+    counts = dict((keyword, {'count': 0, 'hexcodecount': 0})
+                  for keyword in KEYWORDS + (COLORS,))
+    header = data[:1024]
+    index = header.find('%PDF')
+    if index == -1:
+        return None
+    # PDFiD starts counting after the end of line of the header.
+    try:
+        for start in range(index + 4, index + 4 + 10):
+            if header[start] in '\r\n':
+                break
+    except IndexError:
+        return counts
+
+    for match in _keyword_re.finditer(data, start):
+        keyword = _group_keywords[match.lastindex]
+        (begin, end) = match.span()
+        after = data[end:end + 1]
+        if after and _is_word(after):
+            continue
+        if keyword.startswith('/'):
+            # A #xx hex code after the name makes it part of the name.
+            if after == '#' and _is_hex(data, end + 1):
+                continue
+            if data[begin] == '#':
+                # Only an invalid hex code ends a name and starts a new one.
+                if _is_hex(data, begin + 1) or not _slash(data, start, begin):
+                    continue
+            if keyword == '/Colors':
+                counts[COLORS]['count'] += _count_colors(data, end, True)
+                continue
+            counts[keyword]['count'] += 1
+            if '#' in data[begin + 1:end]:
+                counts[keyword]['hexcodecount'] += 1
+        else:
+            if begin > start:
+                before = data[begin - 1]
+                if _is_word(before) or before == '/':
+                    continue
+                if before == '#' and _slash(data, start, begin - 1):
+                    continue
+            counts[keyword]['count'] += 1
+    return counts
@@ -261,10 +261,10 @@ class cPDFTokenizer:
         self.ungetted.append(byte)
 
 class cPDFParser:
-    def __init__(self, file, verbose=False, extract=None):
+    def __init__(self, file, verbose=False, extract=None, tokenizer=None):
         self.context = CONTEXT_NONE
         self.content = []
-        self.oPDFTokenizer = cPDFTokenizer(file)
+        self.oPDFTokenizer = (tokenizer or cPDFTokenizer)(file)
         self.verbose = verbose
         self.extract = extract
 
@@ -472,9 +472,19 @@ class cPDFElementIndirectObject:
             return keyword.lower() in streamData.lower()
 
     def Stream(self, filter=True):
+        data, filters = self.RawStream()
+        if data is None:
+            return filters
+        if filter:
+            return self.Decompress(data, filters)
+        else:
+            return data
+
+    def RawStream(self):
+        # Returns (raw stream data, filters), data is None without endstream
         state = 'start'
         countDirectories = 0
-        data = ''
+        data = []
         filters = []
         for i in range(0, len(self.content)):
             if state == 'start':
@@ -502,19 +512,14 @@ class cPDFElementIndirectObject:
                     state = 'stream-whitespace'
             elif state == 'stream-whitespace':
                 if self.content[i][0] != CHAR_WHITESPACE:
-                    data += self.content[i][1]
+                    data.append(self.content[i][1])
                 state = 'stream-concat'
             elif state == 'stream-concat':
                 if self.content[i][0] == CHAR_REGULAR and self.content[i][1] == 'endstream':
-                    if filter:
-                        return self.Decompress(data, filters)
-                    else:
-                        return data
+                    return ''.join(data), filters
                 else:
-                    data += self.content[i][1]
-            else:
-                return 'Unexpected filter state'
-        return filters
+                    data.append(self.content[i][1])
+        return None, filters
 
     def Decompress(self, data, filters):
         for filter in filters:
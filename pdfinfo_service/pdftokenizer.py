@@ -0,0 +1,181 @@
+"""
+Buffered backends for the pdf-parser tokenizer and the PDFiD binary file.
+
+pdfparser.cPDFTokenizer and pdfid.cBinaryFile read the PDF one byte at a
+time through BytesIO.read(1). The classes here work directly on the data
+already in memory with an integer cursor and produce exactly the same
+tokens and bytes, so they can be handed to cPDFParser and PDFiD without
+changing their output:
+
+    pdfparser.cPDFParser(data, tokenizer=pdftokenizer.cPDFBufferTokenizer)
+    pdfid.PDFiD(data, binaryFile=pdftokenizer.cBufferBinaryFile)
+
+cPDFStreamSkipTokenizer additionally slices stream bodies out in one piece
+using the /Length of the stream dictionary instead of tokenizing them.
+"""
+
+import re
+
+from pdfparser import CHAR_WHITESPACE, CHAR_DELIMITER, CHAR_REGULAR, Canonicalize
+
+# Every byte is either whitespace, a delimiter or regular, so successive
+# matches of this expression cover the whole document. A comment runs up to
+# and including its end of line, plus one following line feed, just like
+# cPDFTokenizer.
+_token_re = re.compile(r'([\x00\t\n\x0c\r ]+)'
+                       r'|([^\x00\t\n\x0c\r ()<>\[\]{}/%]+)'
+                       r'|(<<|>>|%[^\r\n]*(?:[\r\n]\n?)?|[()<>\[\]{}/])')
+
+_token_classes = {1: CHAR_WHITESPACE, 2: CHAR_REGULAR, 3: CHAR_DELIMITER}
+
+_whitespace_re = re.compile(r'[\x00\t\n\x0c\r ]+')
+
+# endstream as a token of its own, after any whitespace.
+_endstream_re = re.compile(r'[\x00\t\n\x0c\r ]*endstream(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])')
+
+# Stream dictionaries larger than this are not searched for a /Length.
+MAX_DICTIONARY_SIZE = 64 * 1024
+
+
+class cPDFBufferTokenizer:
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+        self.ungetted = []
+
+    def Token(self):
+        if len(self.ungetted) != 0:
+            return self.ungetted.pop()
+        match = _token_re.match(self.data, self.position)
+        if match == None:
+            return None
+        self.position = match.end()
+        return (_token_classes[match.lastindex], match.group())
+
+    def TokenIgnoreWhiteSpace(self):
+        token = self.Token()
+        while token != None and token[0] == CHAR_WHITESPACE:
+            token = self.Token()
+        return token
+
+    def unget(self, byte):
+        self.ungetted.append(byte)
+
+
+class cPDFStreamSkipTokenizer(cPDFBufferTokenizer):
+    """
+    When a stream dictionary has a direct /Length which ends right before
+    endstream, the stream body is returned as a single token. The tokens
+    before and after the body are the same as cPDFBufferTokenizer returns,
+    so cPDFElementIndirectObject.Stream() gives the same data. Otherwise
+    the body is tokenized as usual.
+    """
+
+    def __init__(self, data):
+        cPDFBufferTokenizer.__init__(self, data)
+        self.objectPosition = None
+        self.streamsSkipped = 0
+        self.streamsScanned = 0
+
+    def Token(self):
+        if len(self.ungetted) != 0:
+            return self.ungetted.pop()
+        token = cPDFBufferTokenizer.Token(self)
+        if token == None or token[0] != CHAR_REGULAR:
+            return token
+        # Skip names such as /stream.
+        if self.data[self.position - len(token[1]) - 1:self.position - len(token[1])] == '/':
+            return token
+        if token[1] == 'obj':
+            self.objectPosition = self.position
+        elif token[1] == 'stream' and self.objectPosition != None:
+            if self.SkipStream(self.position - len(token[1])):
+                self.streamsSkipped += 1
+            else:
+                self.streamsScanned += 1
+            self.objectPosition = None
+        return token
+
+    def StreamLength(self, streamStart):
+        """
+        Return the direct /Length of the dictionary between the current
+        object and streamStart, or None.
+        """
+        if streamStart - self.objectPosition > MAX_DICTIONARY_SIZE:
+            return None
+        tokens = [match.group() for match in _token_re.finditer(self.data, self.objectPosition, streamStart)
+                  if match.lastindex != 1]
+        depth = 0
+        for i in range(0, len(tokens) - 1):
+            if tokens[i] == '<<':
+                depth += 1
+            elif tokens[i] == '>>':
+                depth -= 1
+            elif depth == 1 and tokens[i] == '/' and Canonicalize('/' + tokens[i + 1]) == '/Length':
+                value = tokens[i + 2:i + 5]
+                if not value or not value[0].isdigit():
+                    return None
+                # An indirect reference is not read here.
+                if len(value) == 3 and value[1].isdigit() and value[2] == 'R':
+                    return None
+                return int(value[0])
+        return None
+
+    def SkipStream(self, streamStart):
+        length = self.StreamLength(streamStart)
+        if length == None:
+            return False
+        # The stream keyword is followed by CRLF or LF, some writers use CR.
+        if self.data.startswith('\r\n', self.position):
+            bodyStart = self.position + 2
+        elif self.data[self.position:self.position + 1] in ('\r', '\n'):
+            bodyStart = self.position + 1
+        else:
+            return False
+        bodyEnd = bodyStart + length
+        if bodyEnd > len(self.data) or not _endstream_re.match(self.data, bodyEnd):
+            return False
+        whitespace = _whitespace_re.match(self.data, self.position)
+        if whitespace.end() > bodyEnd:
+            return False
+        tokens = [(CHAR_WHITESPACE, whitespace.group())]
+        if whitespace.end() < bodyEnd:
+            tokens.append((CHAR_REGULAR, self.data[whitespace.end():bodyEnd]))
+        tokens.reverse()
+        self.ungetted.extend(tokens)
+        self.position = bodyEnd
+        return True
+
+
+class cBufferBinaryFile:
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.position = 0
+        self.ungetted = []
+
+    def byte(self):
+        if len(self.ungetted) != 0:
+            return self.ungetted.pop()
+        if self.position >= len(self.data):
+            return None
+        self.position += 1
+        return self.data[self.position - 1]
+
+    def bytes(self, size):
+        # Same (front of the unget list first) order as cBinaryFile.
+        if size <= len(self.ungetted):
+            result = self.ungetted[0:size]
+            del self.ungetted[0:size]
+            return result
+        end = self.position + size - len(self.ungetted)
+        result = self.ungetted + list(self.data[self.position:end])
+        self.position = min(end, len(self.data))
+        self.ungetted = []
+        return result
+
+    def unget(self, byte):
+        self.ungetted.append(byte)
+
+    def ungets(self, bytes):
+        bytes.reverse()
+        self.ungetted.extend(bytes)
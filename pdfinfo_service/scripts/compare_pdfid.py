@@ -0,0 +1,131 @@
+"""
+Compare the keyword counts of PDFiD with the pdfkeywords counter pdfinfo
+uses, on a directory of PDF files.
+
+Example Usage:
+    python manage.py runscript pdfinfo_service compare_pdfid -- -d /path/to/pdf/corpus -v
+
+Any file where the counts differ is printed along with the differing
+keywords. The pdfid results PDFInfoService.run_pdfid adds with and without
+the fast path are also compared row by row, including the type of each
+count and the escaping of each keyword name, and any file where they differ
+is printed. Nothing is read from or written to the database.
+"""
+
+import os
+import time
+from optparse import OptionParser
+
+from crits.core.basescript import CRITsBaseScript
+from pdfinfo_service import PDFInfoService, pdfid, pdfkeywords, pdftokenizer
+
+def pdfid_counts(data):
+    xml_data = pdfid.PDFiD(data, binaryFile=pdftokenizer.cBufferBinaryFile)
+    keywords = xml_data.documentElement.getElementsByTagName('Keywords')
+    if not keywords:
+        return None
+    counts = {}
+    for node in keywords[0].childNodes:
+        counts[node.getAttribute('Name')] = {
+            'count': int(node.getAttribute('Count')),
+            'hexcodecount': int(node.getAttribute('HexcodeCount')),
+        }
+    return counts
+
+class PDFiDRows(PDFInfoService):
+    """
+    PDFInfoService which records the results of run_pdfid, outside a
+    service run.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def _add_result(self, subtype, result, data):
+        self.rows.append((subtype, result, data))
+
+    def _info(self, message):
+        pass
+
+def pdfid_rows(data, fast):
+    service = PDFiDRows()
+    service.run_pdfid(data, fast)
+    # Compare the count types as well, '7' and 7 are stored differently.
+    return [(subtype, result, dict((key, (type(value).__name__, value))
+                                   for (key, value) in data.iteritems()))
+            for (subtype, result, data) in service.rows]
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-d", "--directory", action="store", dest="directory",
+                type="string", help="directory of PDF files")
+        parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                default=False, help="Be verbose")
+        (opts, args) = parser.parse_args(argv)
+
+        if not opts.directory:
+            print "Need a directory of PDF files."
+            return
+
+        files = 0
+        mismatches = 0
+        row_mismatches = 0
+        classic_time = 0.0
+        fast_time = 0.0
+        for root, dirs, names in os.walk(opts.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if not data:
+                    continue
+                files += 1
+
+                start = time.time()
+                try:
+                    expected = pdfid_counts(data)
+                except Exception, e:
+                    # PDFiD itself fails on some truncated files.
+                    if opts.verbose:
+                        print "[-] %s: PDFiD failed: %s" % (path, e)
+                    continue
+                classic_time += time.time() - start
+
+                start = time.time()
+                counts = pdfkeywords.count_keywords(data)
+                fast_time += time.time() - start
+
+                if counts != expected:
+                    mismatches += 1
+                    print "[-] %s" % path
+                    for keyword in sorted(set(expected or {}) | set(counts or {})):
+                        a = (expected or {}).get(keyword)
+                        b = (counts or {}).get(keyword)
+                        if a != b:
+                            print "    %s: PDFiD %s, pdfkeywords %s" % (keyword, a, b)
+                elif opts.verbose:
+                    print "[+] %s" % path
+
+                try:
+                    expected_rows = pdfid_rows(data, False)
+                except Exception, e:
+                    if opts.verbose:
+                        print "[-] %s: PDFiD results failed: %s" % (path, e)
+                    continue
+                rows = pdfid_rows(data, True)
+                if rows != expected_rows:
+                    row_mismatches += 1
+                    print "[-] %s: results differ" % path
+                    for i in xrange(max(len(rows), len(expected_rows))):
+                        a = expected_rows[i] if i < len(expected_rows) else None
+                        b = rows[i] if i < len(rows) else None
+                        if a != b:
+                            print "    PDFiD %r, fast %r" % (a, b)
+
+        print "[+] %d files, %d mismatches, %d result mismatches" % (files, mismatches,
+                                                                  row_mismatches)
+        print "[+] PDFiD %.2f seconds, pdfkeywords %.2f seconds" % (classic_time, fast_time)
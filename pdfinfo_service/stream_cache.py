@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class StreamCache(object):
+    """
+    Process-wide cache of decompressed PDF stream hashes.
+
+    The same fonts, ICC profiles and scripts turn up in many PDFs. Entries
+    are keyed by the MD5 of the raw stream and its filters, and hold the
+    stream_md5 pdfinfo reports for it, so a stream seen before does not
+    have to be decompressed again. The most recently used entries are kept
+    in memory. When a cache directory is given entries are also saved to
+    disk so they are shared between workers and survive restarts.
+
+    Disk entries are spread over 256 subdirectories. When a disk size is
+    given, one subdirectory is pruned every PRUNE_INTERVAL saves, in turn,
+    down to its share of the size, removing the least recently used files
+    first, so the directory stays bounded without a separate cleanup job.
+    """
+
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self, size=65536):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._saves = 0
+        self._prune_next = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.pruned = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'pruned': self.pruned,
+                'entries': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+    @staticmethod
+    def key(raw, filters):
+        """
+        Return the cache key for a raw stream and its list of filters.
+        """
+
+        return "%s:%s" % (hashlib.md5(raw).hexdigest(), ' '.join(filters))
+
+    def get(self, key, cachedir=None):
+        """
+        Return the cached stream_md5 for key, or None.
+        """
+
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+                self.hits += 1
+                return value
+
+        value = self._load(key, cachedir)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._add(key, value)
+        return value
+
+    def put(self, key, value, cachedir=None, disk_size=0):
+        """
+        Add an entry. disk_size is the most entries to keep in cachedir,
+        0 means no limit.
+        """
+
+        with self._lock:
+            self._add(key, value)
+        if self._save(key, value, cachedir) and disk_size:
+            with self._lock:
+                self._saves += 1
+                prune = self._saves % self.PRUNE_INTERVAL == 0
+                if prune:
+                    subdir = "%02x" % self._prune_next
+                    self._prune_next = (self._prune_next + 1) % 256
+            if prune:
+                self._prune(os.path.join(cachedir, subdir), max(1, disk_size // 256))
+
+    def _add(self, key, value):
+        self._entries[key] = value
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _cache_path(key, cachedir):
+        name = hashlib.md5(key).hexdigest()
+        return os.path.join(cachedir, name[:2], name)
+
+    def _load(self, key, cachedir):
+        if not cachedir:
+            return None
+        cache_path = self._cache_path(key, cachedir)
+        try:
+            with open(cache_path, 'rb') as f:
+                (cached_key, value) = f.read().split('\n', 1)
+        except (IOError, ValueError):
+            return None
+        # Guard against hash collisions on the file name.
+        if cached_key != key:
+            return None
+        # Mark the entry as recently used so pruning keeps it.
+        try:
+            os.utime(cache_path, None)
+        except OSError:
+            pass
+        return value
+
+    def _save(self, key, value, cachedir):
+        if not cachedir:
+            return False
+        cache_path = self._cache_path(key, cachedir)
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(cache_path)):
+                os.makedirs(os.path.dirname(cache_path))
+            with open(tmp_path, 'wb') as f:
+                f.write("%s\n%s" % (key, value))
+            # Rename so other workers never read a partial file.
+            os.rename(tmp_path, cache_path)
+        except (OSError, IOError) as e:
+            logger.warning("Unable to save stream cache entry to %s: %s" % (cache_path, e))
+            return False
+        return True
+
+    def _prune(self, directory, limit):
+        """
+        Remove the least recently used files in directory until at most
+        limit are left.
+        """
+
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        if len(names) <= limit:
+            return
+        files = []
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                # Removed or renamed by another worker.
+                continue
+        files.sort()
+        removed = 0
+        for (mtime, path) in files[:len(files) - limit]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        with self._lock:
+            self.pruned += removed
+
+
+stream_cache = StreamCache()
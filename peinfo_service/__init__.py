@@ -23,6 +23,8 @@ from crits.services.core import Service, ServiceConfigError
 from crits.samples.handlers import handle_file
 from crits.vocabulary.relationships import RelationshipTypes
 
+from .pe_features import save_features
+
 from . import forms
 
 logger = logging.getLogger(__name__)
@@ -38,11 +40,22 @@ class PEInfoService(Service):
     """
 
     name = "peinfo"
-    version = '1.1.4'
+    version = '1.3.0'
     supported_types = ['Sample']
     description = "Generate metadata about Windows PE/COFF files."
     added_files = []
 
+    # Data directories each run form option needs pefile to parse. The
+    # headers, sections and rich header are always parsed.
+    FEATURE_DIRECTORIES = {
+        'parse_imports': ['IMAGE_DIRECTORY_ENTRY_IMPORT'],
+        'parse_exports': ['IMAGE_DIRECTORY_ENTRY_EXPORT'],
+        'parse_resources': ['IMAGE_DIRECTORY_ENTRY_RESOURCE'],
+        'parse_version_info': ['IMAGE_DIRECTORY_ENTRY_RESOURCE'],
+        'parse_debug': ['IMAGE_DIRECTORY_ENTRY_DEBUG'],
+        'parse_tls': ['IMAGE_DIRECTORY_ENTRY_TLS'],
+    }
+
     @staticmethod
     def valid_for(obj):
         # Only run on PE files
@@ -51,8 +64,10 @@ class PEInfoService(Service):
 
     @staticmethod
     def bind_runtime_form(analyst, config):
-        if 'resource' not in config:
-            config['resource'] = False
+        # Unchecked boxes are not submitted.
+        for name in ['resource'] + PEInfoService.FEATURE_DIRECTORIES.keys():
+            if name not in config:
+                config[name] = False
         return forms.PEInfoRunForm(config)
 
     @classmethod
@@ -106,6 +121,10 @@ class PEInfoService(Service):
         hp_size_xor = bitstring.BitArray(bytes=hp_size_xor.tobytes())
         pehash_bin.append(hp_size_xor)
 
+        # Build the image once and slice it per section, rebuilding it for
+        # every section made this quadratic in the number of sections.
+        image = memoryview(exe.write())
+
         #Section chars
         for section in exe.sections:
             #virutal address
@@ -131,7 +150,7 @@ class PEInfoService(Service):
             #entropy calulation
             address = section.VirtualAddress
             size = section.SizeOfRawData
-            raw = exe.write()[address+size:]
+            raw = image[address+size:]
             if size == 0:
                 kolmog = bitstring.BitArray(float=1, length=32)
                 pehash_bin.append(kolmog[0:7])
@@ -147,21 +166,48 @@ class PEInfoService(Service):
         m.update(pehash_bin.tobytes())
         output = m.hexdigest()
         self._add_result('PEhash value', "%s" % output, {'Value': output})
+        return output
+
+    @staticmethod
+    def _enabled_features(config):
+        # Options missing from the config (e.g. triggered runs) default on.
+        return [name for name in PEInfoService.FEATURE_DIRECTORIES
+                if config.get(name, True)]
+
+    @staticmethod
+    def _load_pe(data, features):
+        """
+        Parse the PE headers and only the data directories needed for the
+        enabled features. Relocations, load config, bound and delay imports
+        and the rest are never used by this service so are never parsed.
+        """
+
+        pe = pefile.PE(data=data, fast_load=True)
+        directories = set()
+        for name in features:
+            directories.update(pefile.DIRECTORY_ENTRY[d]
+                               for d in PEInfoService.FEATURE_DIRECTORIES[name])
+        if directories:
+            pe.parse_data_directories(directories=sorted(directories))
+        return pe
 
     def run(self, obj, config):
+        features = self._enabled_features(config)
         try:
-            pe = pefile.PE(data=obj.filedata.read())
+            pe = self._load_pe(obj.filedata.read(), features)
         except pefile.PEFormatError as e:
             self._error("A PEFormatError occurred: %s" % e)
             return
-        self._get_sections(pe)
-        self._get_pehash(pe)
+        section_md5s = self._get_sections(pe)
+        pehash = self._get_pehash(pe)
 
-        if hasattr(pe, 'DIRECTORY_ENTRY_RESOURCE'):
+        if 'parse_resources' not in features:
+            self._debug("Resource parsing disabled")
+        elif hasattr(pe, 'DIRECTORY_ENTRY_RESOURCE'):
             self._dump_resource_data("ROOT",
                                      pe.DIRECTORY_ENTRY_RESOURCE,
                                      pe,
-                                     config['resource'])
+                                     config.get('resource', False))
             for f in self.added_files:
                 handle_file(f[0], f[1], obj.source,
                             related_id=str(obj.id),
@@ -174,44 +220,65 @@ class PEInfoService(Service):
         else:
             self._debug("No resources")
 
-        if hasattr(pe, 'DIRECTORY_ENTRY_IMPORT'):
+        if 'parse_imports' not in features:
+            self._debug("Import parsing disabled")
+        elif hasattr(pe, 'DIRECTORY_ENTRY_IMPORT'):
             self._get_imports(pe)
         else:
             self._debug("No imports")
 
-        if hasattr(pe, 'DIRECTORY_ENTRY_EXPORT'):
+        if 'parse_exports' not in features:
+            self._debug("Export parsing disabled")
+        elif hasattr(pe, 'DIRECTORY_ENTRY_EXPORT'):
             self._get_exports(pe)
         else:
             self._debug("No exports")
 
-        if hasattr(pe, 'VS_VERSIONINFO'):
+        if 'parse_version_info' not in features:
+            self._debug("Version information parsing disabled")
+        elif hasattr(pe, 'VS_VERSIONINFO'):
             self._get_version_info(pe)
         else:
             self._debug("No Version information")
 
-        if hasattr(pe, 'DIRECTORY_ENTRY_DEBUG'):
+        if 'parse_debug' not in features:
+            self._debug("Debug info parsing disabled")
+        elif hasattr(pe, 'DIRECTORY_ENTRY_DEBUG'):
             self._get_debug_info(pe)
         else:
             self._debug("No debug info")
 
-        if hasattr(pe, 'DIRECTORY_ENTRY_TLS'):
+        if 'parse_tls' not in features:
+            self._debug("TLS parsing disabled")
+        elif hasattr(pe, 'DIRECTORY_ENTRY_TLS'):
             self._get_tls_info(pe)
         else:
             self._debug("No TLS info")
 
-        if callable(getattr(pe, 'get_imphash', None)):
-            self._get_imphash(pe)
-        else:
-            self._debug("pefile does not support get_imphash, upgrade to 1.2.10-139")
+        # Only the features computed by this run are saved, so a run with
+        # import parsing disabled keeps the stored imphash.
+        pivots = {'pehash': pehash, 'section_md5s': section_md5s}
+        if 'parse_imports' in features:
+            if callable(getattr(pe, 'get_imphash', None)):
+                pivots['imphash'] = self._get_imphash(pe)
+            else:
+                self._debug("pefile does not support get_imphash, upgrade to 1.2.10-139")
 
         self._get_timestamp(pe)
-        self._get_rich_header(pe)
+        pivots['rich_header'] = self._get_rich_header(pe)
+
+        # Keep the pivot features in their own indexed collection so
+        # searching by any of them is an index lookup.
+        try:
+            save_features(obj.md5, **pivots)
+        except Exception as e:
+            self._error("Unable to save PE features: %s" % e)
 
     # http://www.ntcore.com/files/richsign.htm
     def _get_rich_header(self, pe):
         rich_hdr = pe.parse_rich_header()
         if not rich_hdr:
-            return
+            return None
         data = {"raw": str(rich_hdr['values'])}
         self._add_result('rich_header', hex(rich_hdr['checksum']), data)
 
@@ -243,26 +310,36 @@ class PEInfoService(Service):
         for hv in headervalues:
             sha_256.update(struct.pack('<I', hv))
         self._add_result('rich_header', sha_256.hexdigest(), None)
+        return sha_256.hexdigest()
 
     def _get_imphash(self, pe):
         imphash = pe.get_imphash()
         self._add_result('imphash', imphash, {'import_hash': imphash})
+        return imphash
 
     def _dump_resource_data(self, name, dir, pe, save):
-        for i in dir.entries:
+        # Map the image once for every resource. Walk the tree with an
+        # explicit stack, in the same order as recursing would, so deep or
+        # looping resource trees can not exhaust the Python stack.
+        image = memoryview(pe.get_memory_mapped_image())
+        stack = [(name, iter(dir.entries))]
+        while stack:
+            (name, entries) = stack[-1]
+            i = next(entries, None)
+            if i is None:
+                stack.pop()
+                continue
             try:
                 if hasattr(i, 'data'):
                     x = i.data
                     rva = x.struct.OffsetToData
                     rname = "%s_%s_%s" % (name, i.name, x.struct.name)
                     size = x.struct.Size
-                    data = pe.get_memory_mapped_image()[rva:rva + size]
-                    if not data:
-                        data = ""
+                    data = image[rva:rva + size]
                     if len(data) > 0:
                         if (save or data[:2] == 'MZ' or data[:4] == "%%PDF"):
                             self._debug("Adding new file from resource len %d - %s" % (len(data), rname))
-                            self.added_files.append((rname, data))
+                            self.added_files.append((rname, data.tobytes()))
                     results = {
                             "resource_type": x.struct.name.decode('UTF-8', errors='replace') ,
                             "resource_id": i.id,
@@ -276,12 +353,12 @@ class PEInfoService(Service):
                     self._add_result('pe_resource', x.struct.name, results)
                 if hasattr(i, "directory"):
                     self._debug("Parsing next directory entry %s" % i.name)
-                    self._dump_resource_data(name + "_%s" % i.name,
-                                             i.directory, pe, save)
+                    stack.append((name + "_%s" % i.name, iter(i.directory.entries)))
             except Exception as e:
                 self._parse_error("Resource directory entry", e)
 
     def _get_sections(self, pe):
+        section_md5s = []
         for section in pe.sections:
             try:
                 section_name = section.Name.decode('UTF-8', errors='replace')
@@ -295,9 +372,11 @@ class PEInfoService(Service):
                         "entropy": section.get_entropy(),
                 }
                 self._add_result('pe_section', section_name, data)
+                section_md5s.append(data['md5'])
             except Exception as e:
                 self._parse_error("section info", e)
                 continue
+        return section_md5s
 
     def _get_imports(self, pe):
         try:
@@ -7,6 +7,30 @@ class PEInfoRunForm(forms.Form):
                                   label="Resources",
                                   help_text="New samples from resources.",
                                   initial=True)
+    parse_imports = forms.BooleanField(required=False,
+                                       label="Imports",
+                                       help_text="Parse imports and imphash.",
+                                       initial=True)
+    parse_exports = forms.BooleanField(required=False,
+                                       label="Exports",
+                                       help_text="Parse exports.",
+                                       initial=True)
+    parse_resources = forms.BooleanField(required=False,
+                                         label="Resource list",
+                                         help_text="Parse and list resources.",
+                                         initial=True)
+    parse_version_info = forms.BooleanField(required=False,
+                                            label="Version info",
+                                            help_text="Parse version information.",
+                                            initial=True)
+    parse_debug = forms.BooleanField(required=False,
+                                     label="Debug info",
+                                     help_text="Parse debug directory.",
+                                     initial=True)
+    parse_tls = forms.BooleanField(required=False,
+                                   label="TLS callbacks",
+                                   help_text="Parse TLS callbacks.",
+                                   initial=True)
 
     def __init__(self, *args, **kwargs):
         super(PEInfoRunForm, self).__init__(*args, **kwargs)
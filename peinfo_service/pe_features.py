@@ -0,0 +1,85 @@
+from mongoengine import Document, StringField, ListField
+
+from crits.core.crits_mongoengine import CritsDocument
+
+
+class PEFeatures(CritsDocument, Document):
+    """PE pivot features Document Object"""
+    meta = {
+        "collection": 'pe_features',
+        "crits_type": 'pe_features',
+        "latest_schema_version": 1,
+        "schema_doc": {
+            'md5': "MD5 of the sample",
+            'imphash': "Import hash",
+            'rich_header': "SHA-256 of the decoded rich header",
+            'pehash': "PEhash",
+            'section_md5s': "MD5 of each section",
+        },
+        "indexes": [
+            'imphash',
+            'rich_header',
+            'pehash',
+            'section_md5s',
+        ],
+    }
+
+    md5 = StringField(required=True, unique=True)
+    imphash = StringField()
+    rich_header = StringField()
+    pehash = StringField()
+    section_md5s = ListField(StringField())
+
+    def migrate(self):
+        pass
+
+
+def features_update(**features):
+    """
+    Return the update setting the given pivot features of a sample. Features
+    which are not given, e.g. the imphash of a run with import parsing
+    disabled, are left as they are.
+    """
+
+    fields = {'schema_version': PEFeatures._meta['latest_schema_version']}
+    for name, value in features.iteritems():
+        if name == 'section_md5s':
+            value = sorted(set(value or []))
+        fields[name] = value
+    return {'$set': fields}
+
+
+def features_from_results(results):
+    """
+    Pull the pivot features out of the result list of a peinfo
+    AnalysisResult. Returns a dictionary of keyword arguments for
+    features_update(). Features without a result, e.g. section md5s of an
+    older result without section rows, are left out.
+    """
+
+    features = {}
+    for result in results:
+        subtype = result.get('subtype')
+        if subtype == 'imphash':
+            features['imphash'] = result.get('result')
+        elif subtype == 'PEhash value':
+            features['pehash'] = result.get('result')
+        elif subtype == 'rich_header':
+            # The checksum result is hex() of an int, the hash is bare hex.
+            value = result.get('result') or ''
+            if len(value) == 64 and not value.startswith('0x'):
+                features['rich_header'] = value
+        elif subtype == 'pe_section':
+            if result.get('md5'):
+                features.setdefault('section_md5s', []).append(result['md5'])
+    return features
+
+
+def save_features(md5, **features):
+    """
+    Add or update the given pivot features of a sample.
+    """
+
+    PEFeatures._get_collection().update({'md5': md5},
+                                        features_update(**features),
+                                        upsert=True)
@@ -0,0 +1,81 @@
+"""
+Build or update the pe_features collection from existing peinfo results.
+
+Example Usage:
+    python manage.py runscript peinfo_service backfill -- -v
+    python manage.py runscript peinfo_service backfill -- -r 54e3a2b0c4d5...
+
+Results are read in ObjectId order, so when a Sample has been analyzed more
+than once the features from its latest peinfo run are kept.
+"""
+
+from optparse import OptionParser
+
+from bson.objectid import ObjectId
+
+from crits.core.basescript import CRITsBaseScript
+from crits.samples.sample import Sample
+from crits.services.analysis_result import AnalysisResult
+from peinfo_service import PEInfoService
+from peinfo_service.pe_features import PEFeatures, features_update, features_from_results
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def _flush(self, col, batch):
+        # Results only carry the Sample ObjectId, look up the md5s at once.
+        ids = [ObjectId(object_id) for (object_id, features) in batch
+               if ObjectId.is_valid(object_id)]
+        md5s = dict((str(doc['_id']), doc['md5'])
+                    for doc in Sample._get_collection().find({'_id': {'$in': ids}},
+                                                             {'md5': 1}))
+        bulk = col.initialize_ordered_bulk_op()
+        count = 0
+        for (object_id, features) in batch:
+            md5 = md5s.get(object_id)
+            if not md5:
+                continue
+            bulk.find({'md5': md5}).upsert().update_one(features_update(**features))
+            count += 1
+        if count:
+            bulk.execute()
+        return count
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-r", "--resume", action="store", dest="resume",
+                type="string", help="AnalysisResult ObjectId to resume after")
+        parser.add_option("-b", "--batch", action="store", dest="batch",
+                type="int", default=1000, help="documents per bulk write")
+        parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                default=False, help="Be verbose")
+        (opts, args) = parser.parse_args(argv)
+
+        query = {'service_name': PEInfoService.name,
+                 'object_type': 'Sample',
+                 'status': 'completed'}
+        if opts.resume:
+            query['_id'] = {'$gt': ObjectId(opts.resume)}
+
+        # Make sure the indexes exist before bulk loading.
+        PEFeatures.ensure_indexes()
+        col = PEFeatures._get_collection()
+        analyses = AnalysisResult._get_collection().find(query,
+                                                         {'object_id': 1, 'results': 1},
+                                                         sort=[('_id', 1)])
+        count = 0
+        last_id = None
+        batch = []
+        for analysis in analyses:
+            last_id = analysis['_id']
+            batch.append((analysis.get('object_id'),
+                          features_from_results(analysis.get('results', []))))
+            if len(batch) >= opts.batch:
+                count += self._flush(col, batch)
+                batch = []
+                if opts.verbose:
+                    print "[+] Saved features for %d samples, last: %s" % (count, last_id)
+        if batch:
+            count += self._flush(col, batch)
+        print "[+] Saved features for %d samples, last: %s" % (count, last_id)
@@ -0,0 +1,70 @@
+"""
+Compare full pefile parsing with the peinfo fast load path.
+
+Example Usage:
+    python manage.py runscript peinfo_service benchmark -- -d /path/to/pe/corpus -r 3
+"""
+
+import os
+import time
+from optparse import OptionParser
+
+import pefile
+
+from crits.core.basescript import CRITsBaseScript
+from peinfo_service import PEInfoService
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def _time(self, corpus, rounds, load):
+        start = time.time()
+        for i in xrange(rounds):
+            for data in corpus:
+                try:
+                    load(data)
+                except pefile.PEFormatError:
+                    pass
+        return time.time() - start
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-d", "--directory", action="store", dest="directory",
+                type="string", help="directory of PE files")
+        parser.add_option("-r", "--rounds", action="store", dest="rounds",
+                type="int", default=3, help="times to parse each file")
+        (opts, args) = parser.parse_args(argv)
+
+        if not opts.directory:
+            print "Need a directory of PE files."
+            return
+
+        corpus = []
+        for root, dirs, files in os.walk(opts.directory):
+            for name in files:
+                with open(os.path.join(root, name), 'rb') as f:
+                    data = f.read()
+                if data[:2] == 'MZ':
+                    corpus.append(data)
+        if not corpus:
+            print "No PE files found."
+            return
+        print "[+] %d files, %d bytes, %d rounds" % (len(corpus),
+                                                   sum(len(d) for d in corpus),
+                                                   opts.rounds)
+
+        all_features = PEInfoService.FEATURE_DIRECTORIES.keys()
+        loaders = [
+            ('full parse', lambda data: pefile.PE(data=data)),
+            ('fast load, all options', lambda data: PEInfoService._load_pe(data, all_features)),
+            ('fast load, imports only', lambda data: PEInfoService._load_pe(data, ['parse_imports'])),
+            ('fast load, headers only', lambda data: PEInfoService._load_pe(data, [])),
+        ]
+        baseline = None
+        for name, load in loaders:
+            elapsed = self._time(corpus, opts.rounds, load)
+            if baseline is None:
+                baseline = elapsed
+            print "%-26s %8.2f seconds %6.2fx" % (name, elapsed,
+                                                  baseline / elapsed if elapsed else 0)
@@ -0,0 +1,121 @@
+"""
+Check PEhash values against pinned values.
+
+Example Usage:
+    python manage.py runscript peinfo_service pehash_check -- -d /path/to/pe/fixtures
+    python manage.py runscript peinfo_service pehash_check -- -d /path/to/pe/corpus -p pins.txt -w
+    python manage.py runscript peinfo_service pehash_check -- -d /path/to/pe/corpus -p pins.txt
+
+Every PE file in the directory is hashed with the service's _get_pehash and
+checked against a file of "<md5> <pehash> <file name>" lines. By default the
+pehash_pins.txt file next to this script is used, which pins the PEhash of
+the public launcher and installer executables listed in it. Any pinned file
+whose PEhash differs is reported, as is any pinned file which was not found
+in the directory. Files which make PEhash raise are pinned as
+"error:<exception class>". With -w the current values are written to the
+pins file given with -p instead. Nothing is read from or written to the
+database.
+"""
+
+import hashlib
+import os
+from optparse import OptionParser
+
+import pefile
+
+from crits.core.basescript import CRITsBaseScript
+from peinfo_service import PEInfoService
+
+PINS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pehash_pins.txt')
+
+
+class PEhashService(PEInfoService):
+    """
+    PEInfoService which only computes PEhash, outside a service run.
+    """
+
+    def __init__(self):
+        pass
+
+    def _add_result(self, subtype, result, data):
+        pass
+
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def _pehash(self, service, exe):
+        # Some headers make PEhash raise, which is pinned as well.
+        try:
+            return service._get_pehash(exe)
+        except Exception as e:
+            return "error:%s" % e.__class__.__name__
+
+    def _read_pins(self, path):
+        pins = {}
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and not fields[0].startswith('#'):
+                    pins[fields[0]] = (fields[1], ' '.join(fields[2:]))
+        return pins
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-d", "--directory", action="store", dest="directory",
+                type="string", help="directory of PE files")
+        parser.add_option("-p", "--pins", action="store", dest="pins",
+                type="string", help="file of pinned md5 and PEhash values (default: %s)" % PINS)
+        parser.add_option("-w", "--write", action="store_true", dest="write",
+                default=False, help="write the pins file instead of checking it")
+        (opts, args) = parser.parse_args(argv)
+
+        if not opts.directory:
+            print "Need a directory of PE files."
+            return
+
+        if opts.write and not opts.pins:
+            print "Need a pins file to write."
+            return
+
+        pins = {}
+        if not opts.write:
+            pins = self._read_pins(opts.pins or PINS)
+
+        service = PEhashService()
+        values = []
+        seen = set()
+        differences = 0
+        for root, dirs, files in os.walk(opts.directory):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if data[:2] != 'MZ':
+                    continue
+                try:
+                    exe = PEInfoService._load_pe(data, [])
+                except pefile.PEFormatError:
+                    continue
+                md5 = hashlib.md5(data).hexdigest()
+                value = self._pehash(service, exe)
+                values.append((md5, value, name))
+                if md5 not in pins:
+                    continue
+                seen.add(md5)
+                if value != pins[md5][0]:
+                    differences += 1
+                    print "[-] %s: %s, pinned %s" % (path, value, pins[md5][0])
+
+        if opts.write:
+            with open(opts.pins, 'w') as f:
+                for (md5, value, name) in values:
+                    f.write("%s %s %s\n" % (md5, value, name))
+            print "[+] Wrote %d pins to %s" % (len(values), opts.pins)
+            return
+
+        for md5 in sorted(set(pins) - seen):
+            print "[-] Pinned file not found: %s %s" % (md5, pins[md5][1])
+        print "[+] %d of %d pinned files checked, %d differences" % (len(seen), len(pins),
+                                                                  differences)
@@ -7,6 +7,7 @@ from crits.samples.sample import Sample
 from crits.services.core import Service
 
 from . import forms
+from .ssdeep_index import index_sample, index_status, find_candidates, block_size_filter
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +17,7 @@ class SSDeepService(Service):
     """
 
     name = "ssdeep_compare"
-    version = '1.0.2'
+    version = '1.1.1'
     description = "Compare samples using ssdeep."
     supported_types = ['Sample']
 
@@ -39,6 +40,22 @@ class SSDeepService(Service):
                                  'crits_type': crits_type,
                                  'identifier': identifier})
 
+    def _regex_candidates(self, target_ssdeep, target_mimetype, after=None):
+        # setup the sample space to compare against
+        # first use the mimetype as a comparator if available
+        query_filter = {}
+        if target_mimetype:
+            query_filter['mimetype'] = target_mimetype
+        # only samples added since the index was built, if it has been
+        if after:
+            query_filter['_id'] = {'$gt': after}
+        # then use only samples with a block size ssdeep will compare
+        query_filter.update(block_size_filter(target_ssdeep))
+        result_filter = {'md5': 1, 'ssdeep': 1}
+        candidate_space = Sample.objects(__raw__=query_filter).only(*result_filter)
+        return [(candidate["md5"], candidate["ssdeep"])
+                for candidate in candidate_space if "ssdeep" in candidate]
+
     def run(self, obj, config):
         threshold = config.get("threshold", 50)
         target_ssdeep = obj.ssdeep
@@ -48,25 +65,26 @@ class SSDeepService(Service):
             logger.error = "Could not get the target ssdeep value for sample"
             self._error("Could not get the target ssdeep value for sample")
             return
-        # setup the sample space to compare against
-        # first use the mimetype as a comparator if available
-        query_filter = {}
-        if target_mimetype:
-            query_filter['mimetype'] = target_mimetype
-        # then use only samples with a multiple of chunksize
-        chunk_size = int(target_ssdeep.split(":")[0])
-        query_filter["$or"] = []
-        query_filter["$or"].append({"ssdeep": {"$regex": "^%d:" % chunk_size * 2}})
-        query_filter["$or"].append({"ssdeep": {"$regex": "^%d:" % chunk_size}})
-        query_filter["$or"].append({"ssdeep": {"$regex": "^%d:" % (chunk_size / 2)}})
-        result_filter = {'md5': 1, 'ssdeep': 1}
-        candidate_space = Sample.objects(__raw__=query_filter).only(*result_filter)
+        # Keep the candidate index current with every sample we see.
+        index_sample(target_md5, target_ssdeep, target_mimetype)
+        status = index_status()
+        if status:
+            # Only samples with a compatible block size that share a 7-gram
+            # can score above zero. Samples added since the index script
+            # last ran may not be indexed yet, so scan those as before.
+            candidates = dict(self._regex_candidates(target_ssdeep, target_mimetype,
+                                                     status.last_id))
+            candidates.update(find_candidates(target_ssdeep, target_mimetype))
+            candidate_space = candidates.items()
+        else:
+            self._info("SSDeep index has not been built, falling back to a full scan.")
+            candidate_space = self._regex_candidates(target_ssdeep, target_mimetype)
+        self._info("Comparing against %d candidates" % len(candidate_space))
         match_list = []
-        for candidate in candidate_space:
-            if "ssdeep" in candidate:
-                score = pydeep.compare(target_ssdeep, candidate["ssdeep"])
-                if score >= threshold and candidate["md5"] != target_md5:
-                    match_list.append({'md5': candidate["md5"], 'score': score})
+        for (md5, ssdeep) in candidate_space:
+            score = pydeep.compare(target_ssdeep, ssdeep)
+            if score >= threshold and md5 != target_md5:
+                match_list.append({'md5': md5, 'score': score})
         # finally sort the results
         match_list.sort(key=lambda sample: sample["score"], reverse=True)
         for match in match_list:
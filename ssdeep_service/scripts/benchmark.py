@@ -0,0 +1,118 @@
+"""
+Benchmark ssdeep candidate selection against brute force on a synthetic
+corpus. No database access is needed.
+
+Example Usage:
+    python manage.py runscript ssdeep_service benchmark -- -f 200 -m 5 -n 1000
+
+The corpus is made of families of related files (a random base file and
+mutated copies of it) plus unrelated noise. Every hash is queried against
+the corpus and the matches at or above the threshold found by brute force
+are compared with those found among the candidates each selection strategy
+returns. Recall below 100% for the 7-gram index is a correctness bug;
+candidates per query is the cost.
+"""
+
+import random
+import time
+from optparse import OptionParser
+
+import pydeep
+
+from crits.core.basescript import CRITsBaseScript
+from ssdeep_service.ssdeep_index import MemoryIndex, parse_ssdeep
+
+def _random_bytes(rand, size):
+    # Drawn from rand, not os.urandom, so a seed gives the same corpus.
+    return ('%0*x' % (size * 2, rand.getrandbits(size * 8))).decode('hex')
+
+def _mutate(rand, data):
+    data = bytearray(data)
+    for i in xrange(rand.randint(1, 8)):
+        offset = rand.randint(0, len(data) - 1)
+        size = rand.randint(1, max(1, len(data) // 50))
+        action = rand.randint(0, 2)
+        if action == 0:
+            data[offset:offset + size] = _random_bytes(rand, size)
+        elif action == 1:
+            data[offset:offset] = _random_bytes(rand, size)
+        else:
+            del data[offset:offset + size]
+    return str(data)
+
+def _block_size(ssdeep):
+    return parse_ssdeep(ssdeep)[0]
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def _corpus(self, rand, families, members, noise):
+        hashes = []
+        for family in xrange(families):
+            base = _random_bytes(rand, rand.randint(4 * 1024, 256 * 1024))
+            hashes.append(pydeep.hash_buf(base))
+            for member in xrange(members):
+                hashes.append(pydeep.hash_buf(_mutate(rand, base)))
+        for i in xrange(noise):
+            hashes.append(pydeep.hash_buf(_random_bytes(rand, rand.randint(4 * 1024, 256 * 1024))))
+        return hashes
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-f", "--families", action="store", dest="families",
+                type="int", default=100, help="number of related file families")
+        parser.add_option("-m", "--members", action="store", dest="members",
+                type="int", default=5, help="mutated copies per family")
+        parser.add_option("-n", "--noise", action="store", dest="noise",
+                type="int", default=500, help="number of unrelated files")
+        parser.add_option("-t", "--threshold", action="store", dest="threshold",
+                type="int", default=50, help="match threshold")
+        parser.add_option("-s", "--seed", action="store", dest="seed",
+                type="int", default=0, help="random seed for the corpus")
+        (opts, args) = parser.parse_args(argv)
+
+        rand = random.Random(opts.seed)
+        print "[+] Generating corpus"
+        hashes = self._corpus(rand, opts.families, opts.members, opts.noise)
+        index = MemoryIndex()
+        for i, h in enumerate(hashes):
+            index.add(i, h)
+        sizes = [_block_size(h) for h in hashes]
+
+        # Each strategy returns the candidate keys for query i.
+        strategies = [
+            ('brute force', lambda i: xrange(len(hashes))),
+            ('block size', lambda i: [j for j in xrange(len(hashes))
+                                      if sizes[j] in (sizes[i], sizes[i] * 2, sizes[i] / 2.0)]),
+            # The pre-1.1.1 query: "^%d:" % chunk_size * 2 never matched
+            # double block sizes.
+            ('block size (old)', lambda i: [j for j in xrange(len(hashes))
+                                            if sizes[j] in (sizes[i], sizes[i] // 2)]),
+            ('7-gram index', lambda i: index.candidates(hashes[i])),
+        ]
+
+        expected = None
+        print "[+] %d hashes, threshold %d" % (len(hashes), opts.threshold)
+        print "%-18s %10s %12s %10s" % ("strategy", "recall", "cand/query", "seconds")
+        for name, candidates in strategies:
+            start = time.time()
+            found = set()
+            examined = 0
+            for i in xrange(len(hashes)):
+                for j in candidates(i):
+                    if j == i:
+                        continue
+                    examined += 1
+                    if pydeep.compare(hashes[i], hashes[j]) >= opts.threshold:
+                        found.add((i, j))
+            elapsed = time.time() - start
+            if expected is None:
+                expected = found
+            if expected:
+                recall = 100.0 * len(found & expected) / len(expected)
+            else:
+                recall = 100.0
+            print "%-18s %9.2f%% %12.1f %10.2f" % (name, recall,
+                                                  examined / float(len(hashes)),
+                                                  elapsed)
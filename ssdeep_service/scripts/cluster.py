@@ -0,0 +1,291 @@
+"""
+Cluster Samples into ssdeep similarity families.
+
+Example Usage:
+    python manage.py runscript ssdeep_service cluster -- -n nightly-2015-06-10 -q "{'source.name': 'FOO'}" -t 60 -w 8
+
+Samples are processed one block size at a time. ssdeep only compares hashes
+with the same, double or half block size, so only the samples with block
+size B and B/2 are in memory at once. Within a block size samples are
+bucketed by the integer hash of each shared 7-gram and only pairs sharing a
+bucket are compared, across a pool of worker processes. Block sizes with
+more 7-grams than -S are bucketed in shards, each holding the 7-grams whose
+hash falls in that shard, so the buckets in memory stay bounded. Pairs are
+generated from the buckets as they are compared, in chunks of CHUNK_SIZE
+per worker, and never collected. A pair sharing several 7-grams is only
+compared from the bucket with the lowest hash in each shard, and pairs
+already in the same cluster are not compared again. Pairs scoring at or
+above the threshold are joined into connected components, which are saved
+to the ssdeep_clusters collection and optionally linked with Related_To
+relationships.
+"""
+
+import ast
+import datetime
+import multiprocessing
+import time
+from collections import defaultdict
+from optparse import OptionParser
+
+import pydeep
+
+from crits.core.basescript import CRITsBaseScript
+from crits.samples.sample import Sample
+from crits.vocabulary.relationships import RelationshipTypes
+from ssdeep_service.ssdeep_index import SSDeepCluster, GRAM_SIZE, parse_ssdeep
+
+# ssdeep block sizes are 3 * 2^n.
+MIN_BLOCK_SIZE = 3
+MAX_BLOCK_SHIFT = 32
+
+# Pairs sent to a worker at a time.
+CHUNK_SIZE = 5000
+
+# Most 7-grams an ssdeep hash can have: two 64 character chunks and the
+# exact hash key.
+MAX_HASH_GRAMS = 2 * (64 - GRAM_SIZE + 1) + 1
+
+_threshold = None
+
+
+def _init_worker(threshold):
+    global _threshold
+    _threshold = threshold
+
+
+def _compare(pairs):
+    matches = []
+    for (a, hash_a, b, hash_b) in pairs:
+        if pydeep.compare(hash_a, hash_b) >= _threshold:
+            matches.append((a, b))
+    return matches
+
+
+class UnionFind(object):
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = x
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a != root_b:
+            self.parent.setdefault(root_a, root_a)
+            self.parent[root_b] = root_a
+
+    def components(self):
+        groups = defaultdict(list)
+        for x in self.parent.keys():
+            groups[self.find(x)].append(x)
+        return groups.values()
+
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def _load(self, query, block_size):
+        query = {'$and': [query, {'ssdeep': {'$regex': '^%d:' % block_size}}]}
+        cursor = Sample._get_collection().find(query, {'md5': 1, 'ssdeep': 1, '_id': 0})
+        return [(doc['md5'], doc['ssdeep']) for doc in cursor
+                if doc.get('md5') and parse_ssdeep(doc.get('ssdeep'))]
+
+    def _keys(self, ssdeep, is_current):
+        """
+        Return the set of integer bucket keys for a hash. Samples with half
+        the block size are keyed by the 7-grams of their second chunk.
+        Samples with this block size are keyed by the 7-grams of both chunks,
+        so all pairs of them are found here and never at the next block size,
+        and by their exact hash.
+        """
+
+        (block_size, chunk, double_chunk) = parse_ssdeep(ssdeep)
+        keys = set()
+        if is_current:
+            for i in xrange(len(chunk) - GRAM_SIZE + 1):
+                keys.add(hash((0, chunk[i:i + GRAM_SIZE])))
+            for i in xrange(len(double_chunk) - GRAM_SIZE + 1):
+                keys.add(hash((1, double_chunk[i:i + GRAM_SIZE])))
+            keys.add(hash((2, chunk, double_chunk)))
+        else:
+            for i in xrange(len(double_chunk) - GRAM_SIZE + 1):
+                keys.add(hash((0, double_chunk[i:i + GRAM_SIZE])))
+        return keys
+
+    def _bucket_pairs(self, buckets, member_keys, first_current):
+        """
+        Generate the (a, b) index pairs of each bucket, with a < b. A pair
+        sharing several buckets is only generated by the one with the lowest
+        key. Pairs of previous samples, with b < first_current, were found at
+        the previous block size and are left out.
+        """
+
+        for (key, members) in buckets.iteritems():
+            for i in xrange(len(members)):
+                keys_a = member_keys[members[i]]
+                for j in xrange(i + 1, len(members)):
+                    # Members are in index order, so only pairs of previous
+                    # samples have b < first_current.
+                    b = members[j]
+                    if b >= first_current and min(keys_a & member_keys[b]) == key:
+                        yield (members[i], b)
+        buckets.clear()
+        member_keys.clear()
+
+    def _pairs(self, previous, current, max_bucket, shards):
+        """
+        Generate (pairs, skipped) for each shard of the buckets at one block
+        size, where pairs generates (a, b) indexes into previous + current
+        one bucket at a time. previous holds samples with half the block
+        size, whose second chunk is compared at this block size, and current
+        holds samples with this block size. Each pair is generated once per
+        shard, but may be generated by more than one shard.
+        """
+
+        hashes = previous + current
+        for shard in xrange(shards):
+            buckets = defaultdict(list)
+            for (i, (md5, ssdeep)) in enumerate(hashes):
+                for key in self._keys(ssdeep, i >= len(previous)):
+                    if key % shards == shard:
+                        buckets[key].append(i)
+
+            # The keys of each sample in this shard, to find the lowest
+            # bucket a pair shares.
+            member_keys = defaultdict(set)
+            skipped = 0
+            for key in buckets.keys():
+                if len(buckets[key]) > max_bucket:
+                    del buckets[key]
+                    skipped += 1
+                    continue
+                for i in buckets[key]:
+                    member_keys[i].add(key)
+            yield (self._bucket_pairs(buckets, member_keys, len(previous)), skipped)
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-n", "--name", action="store", dest="name",
+                type="string", help="name of this clustering run")
+        parser.add_option("-q", "--query", action="store", dest="query",
+                type="string", default="{}", help="query filter")
+        parser.add_option("-t", "--threshold", action="store", dest="threshold",
+                type="int", default=50, help="threshold")
+        parser.add_option("-w", "--workers", action="store", dest="workers",
+                type="int", default=multiprocessing.cpu_count(),
+                help="number of worker processes")
+        parser.add_option("-B", "--max-bucket", action="store", dest="max_bucket",
+                type="int", default=1000,
+                help="skip 7-grams shared by more samples than this")
+        parser.add_option("-S", "--shard-grams", action="store", dest="shard_grams",
+                type="int", default=5000000,
+                help="most 7-grams to bucket at once")
+        parser.add_option("-R", "--relationships", action="store_true",
+                dest="relationships", default=False,
+                help="relate cluster members to each other")
+        parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                default=False, help="Be verbose")
+        (opts, args) = parser.parse_args(argv)
+
+        if not opts.name:
+            print "Need a name for this run."
+            return
+
+        try:
+            query = ast.literal_eval(opts.query)
+        except Exception, e:
+            print "Error with query: %s" % e
+            return
+
+        pool = multiprocessing.Pool(opts.workers, _init_worker, (opts.threshold,))
+        clusters = UnionFind()
+        start = time.time()
+        compared = 0
+        previous = []
+        try:
+            for shift in xrange(MAX_BLOCK_SHIFT):
+                block_size = MIN_BLOCK_SIZE << shift
+                current = self._load(query, block_size)
+                if not previous and not current:
+                    continue
+
+                hashes = previous + current
+                shards = max(1, -(-len(hashes) * MAX_HASH_GRAMS // opts.shard_grams))
+                block_pairs = 0
+                block_skipped = 0
+                for (pairs, skipped) in self._pairs(previous, current,
+                                                    opts.max_bucket, shards):
+                    block_skipped += skipped
+                    while True:
+                        chunks = []
+                        for w in xrange(opts.workers):
+                            chunk = []
+                            for (a, b) in pairs:
+                                (a, b) = (hashes[a], hashes[b])
+                                # Pairs already in one cluster can not change it.
+                                if a[0] == b[0] or clusters.find(a[0]) == clusters.find(b[0]):
+                                    continue
+                                chunk.append((a[0], a[1], b[0], b[1]))
+                                if len(chunk) >= CHUNK_SIZE:
+                                    break
+                            if not chunk:
+                                break
+                            chunks.append(chunk)
+                        if not chunks:
+                            break
+                        for matches in pool.map(_compare, chunks):
+                            for (a, b) in matches:
+                                clusters.union(a, b)
+                        block_pairs += sum(len(chunk) for chunk in chunks)
+                compared += block_pairs
+
+                if opts.verbose:
+                    print "[+] Block size %d: %d samples, %d shards, %d pairs, %d skipped buckets, %.1f seconds" % (
+                        block_size, len(current), shards, block_pairs, block_skipped,
+                        time.time() - start)
+
+                previous = current
+        except KeyboardInterrupt:
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+
+        created = datetime.datetime.now()
+        count = 0
+        for members in clusters.components():
+            members.sort()
+            SSDeepCluster(name=opts.name, created=created, threshold=opts.threshold,
+                          size=len(members), md5s=members).save()
+            count += 1
+            if opts.relationships:
+                self._relate(members)
+        print "[+] %d pairs compared, %d clusters, %.1f seconds" % (
+            compared, count, time.time() - start)
+
+    def _relate(self, members):
+        # Relate every member to the first one rather than every pair.
+        first = Sample.objects(md5=members[0]).first()
+        if not first:
+            return
+        for md5 in members[1:]:
+            sample = Sample.objects(md5=md5).first()
+            if not sample:
+                continue
+            result = first.add_relationship(rel_item=sample,
+                                            rel_type=RelationshipTypes.RELATED_TO,
+                                            analyst=self.username,
+                                            rel_confidence='medium',
+                                            rel_reason='ssdeep cluster',
+                                            get_rels=False)
+            if result['success']:
+                sample.save(username=self.username)
+        first.save(username=self.username)
@@ -0,0 +1,96 @@
+"""
+Build or update the ssdeep candidate index from existing Samples.
+
+Example Usage:
+    python manage.py runscript ssdeep_service index -- -v
+    python manage.py runscript ssdeep_service index -- -u
+    python manage.py runscript ssdeep_service index -- -q "{'source.name': 'FOO'}" -r 54e3a2b0c4d5...
+
+When a run without a query filter completes, the index is marked as built
+and the service starts using it. Samples added after that are scanned by the
+service without the index until -u is run to index them.
+"""
+
+import ast
+from optparse import OptionParser
+
+from bson.objectid import ObjectId
+
+from crits.core.basescript import CRITsBaseScript
+from crits.samples.sample import Sample
+from ssdeep_service.ssdeep_index import (SSDeepIndex, index_document, index_status,
+                                        mark_index_built)
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-q", "--query", action="store", dest="query",
+                type="string", default="{}", help="query filter")
+        parser.add_option("-r", "--resume", action="store", dest="resume",
+                type="string", help="ObjectId to resume after")
+        parser.add_option("-u", "--update", action="store_true", dest="update",
+                default=False, help="index samples added since the last completed run")
+        parser.add_option("-b", "--batch", action="store", dest="batch",
+                type="int", default=1000, help="documents per bulk write")
+        parser.add_option("-v", "--verbose", action="store_true", dest="verbose",
+                default=False, help="Be verbose")
+        (opts, args) = parser.parse_args(argv)
+
+        try:
+            query = ast.literal_eval(opts.query)
+        except Exception, e:
+            print "Error with query: %s" % e
+            return
+
+        # Only a run over every Sample can mark the index as built.
+        complete = not query
+        query = {'$and': [query, {'ssdeep': {'$exists': True, '$ne': None}}]}
+        resume = None
+        if opts.resume:
+            resume = ObjectId(opts.resume)
+        elif opts.update:
+            status = index_status()
+            if not status:
+                print "The index has not been built, run without -u first."
+                return
+            resume = status.last_id
+        if resume:
+            query['$and'].append({'_id': {'$gt': resume}})
+
+        # Make sure the indexes exist before bulk loading.
+        SSDeepIndex.ensure_indexes()
+        col = SSDeepIndex._get_collection()
+        samples = Sample._get_collection().find(query,
+                                                {'md5': 1, 'ssdeep': 1, 'mimetype': 1},
+                                                sort=[('_id', 1)])
+        count = 0
+        pending = 0
+        last_id = None
+        bulk = col.initialize_unordered_bulk_op()
+        for sample in samples:
+            doc = index_document(sample.get('md5'), sample['ssdeep'],
+                                 sample.get('mimetype'))
+            last_id = sample['_id']
+            if not doc:
+                continue
+            bulk.find({'md5': doc['md5']}).upsert().replace_one(doc)
+            pending += 1
+            if pending >= opts.batch:
+                bulk.execute()
+                count += pending
+                pending = 0
+                bulk = col.initialize_unordered_bulk_op()
+                if opts.verbose:
+                    print "[+] Indexed %d samples, last: %s" % (count, last_id)
+        if pending:
+            bulk.execute()
+            count += pending
+        print "[+] Indexed %d samples, last: %s" % (count, last_id)
+        if complete:
+            mark_index_built(last_id)
+            print "[+] Index marked as built"
+        else:
+            print "[+] Query filter given, index not marked as built"
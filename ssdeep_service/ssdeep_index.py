@@ -0,0 +1,251 @@
+import datetime
+import re
+from collections import defaultdict
+
+from mongoengine import Document, StringField, IntField, ListField, ObjectIdField
+
+from crits.core.crits_mongoengine import CritsDocument
+from crits.core.fields import CritsDateTimeField
+
+# ssdeep only scores two chunks if they share a substring this long.
+GRAM_SIZE = 7
+
+# ssdeep collapses runs of more than three identical characters.
+_sequence_re = re.compile(r'(.)\1{3,}')
+
+
+class SSDeepIndex(CritsDocument, Document):
+    """SSDeep candidate index Document Object"""
+    meta = {
+        "collection": 'ssdeep_index',
+        "crits_type": 'ssdeep_index',
+        "latest_schema_version": 1,
+        "schema_doc": {
+            'md5': "MD5 of the sample",
+            'ssdeep': "SSDeep hash of the sample",
+            'mimetype': "Mimetype of the sample",
+            'block_size': "Block size of the ssdeep hash",
+            'grams': "Block size prefixed 7-grams of both ssdeep chunks",
+        },
+        "indexes": [
+            {'fields': ['grams', 'mimetype']},
+        ],
+    }
+
+    md5 = StringField(required=True, unique=True)
+    ssdeep = StringField(required=True)
+    mimetype = StringField()
+    block_size = IntField(required=True)
+    grams = ListField(StringField())
+
+    def migrate(self):
+        pass
+
+
+class SSDeepIndexStatus(CritsDocument, Document):
+    """SSDeep candidate index build status Document Object"""
+    meta = {
+        "collection": 'ssdeep_index_status',
+        "crits_type": 'ssdeep_index_status',
+        "latest_schema_version": 1,
+        "schema_doc": {
+            'last_update': "Date the index script last completed",
+            'last_id': "ObjectId of the last Sample indexed by the index script",
+            'count': "Number of samples in the index when last_update was set",
+        },
+    }
+
+    last_update = CritsDateTimeField(required=True)
+    last_id = ObjectIdField()
+    count = IntField(default=0)
+
+    def migrate(self):
+        pass
+
+
+class SSDeepCluster(CritsDocument, Document):
+    """SSDeep similarity cluster Document Object"""
+    meta = {
+        "collection": 'ssdeep_clusters',
+        "crits_type": 'ssdeep_cluster',
+        "latest_schema_version": 1,
+        "schema_doc": {
+            'name': "Name of the clustering run",
+            'created': "Date this cluster was created",
+            'threshold': "Minimum ssdeep score linking members",
+            'size': "Number of members",
+            'md5s': "MD5s of the members",
+        },
+        "indexes": [
+            'name',
+            'md5s',
+        ],
+    }
+
+    name = StringField(required=True)
+    created = CritsDateTimeField(required=True)
+    threshold = IntField(required=True)
+    size = IntField(required=True)
+    md5s = ListField(StringField())
+
+    def migrate(self):
+        pass
+
+
+def parse_ssdeep(ssdeep):
+    """
+    Split an ssdeep hash into (block size, chunk, double chunk), with runs
+    of identical characters collapsed the same way ssdeep does before
+    comparing. Returns None if the hash is malformed.
+    """
+
+    try:
+        block_size, chunk, double_chunk = ssdeep.split(':', 2)
+        block_size = int(block_size)
+    except (AttributeError, ValueError):
+        return None
+    # Some hashes carry a trailing filename.
+    double_chunk = double_chunk.split(',', 1)[0]
+    return (block_size,
+            _sequence_re.sub(r'\1\1\1', chunk),
+            _sequence_re.sub(r'\1\1\1', double_chunk))
+
+
+def _chunk_grams(block_size, chunk):
+    grams = set()
+    for i in xrange(len(chunk) - GRAM_SIZE + 1):
+        grams.add("%d:%s" % (block_size, chunk[i:i + GRAM_SIZE]))
+    return grams
+
+
+def ssdeep_grams(ssdeep):
+    """
+    Return the index keys for an ssdeep hash.
+
+    The first chunk is keyed under the hash block size and the second under
+    twice the block size, so a single lookup finds candidates with the same,
+    double or half block size that share a 7-gram on the chunks ssdeep would
+    actually compare. An exact-hash key is included so identical hashes with
+    chunks too short to have a 7-gram (which ssdeep scores 100) still match.
+    """
+
+    parsed = parse_ssdeep(ssdeep)
+    if not parsed:
+        return []
+    block_size, chunk, double_chunk = parsed
+    grams = _chunk_grams(block_size, chunk)
+    grams.update(_chunk_grams(block_size * 2, double_chunk))
+    grams.add("%d=%s:%s" % (block_size, chunk, double_chunk))
+    return sorted(grams)
+
+
+def block_size_filter(ssdeep):
+    """
+    Return a query on the Sample ssdeep field matching hashes with the same,
+    double or half the block size of the given hash. These are the only
+    block sizes ssdeep will compare.
+    """
+
+    block_size = int(ssdeep.split(':', 1)[0])
+    sizes = [block_size, block_size * 2]
+    if block_size % 2 == 0:
+        sizes.append(block_size // 2)
+    return {'$or': [{'ssdeep': {'$regex': '^%d:' % size}} for size in sizes]}
+
+
+class MemoryIndex(object):
+    """
+    In-memory equivalent of the ssdeep_index collection.
+
+    Useful for batch jobs and benchmarks which already hold the hashes they
+    want to compare.
+    """
+
+    def __init__(self):
+        self._grams = defaultdict(set)
+        self.hashes = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, key, ssdeep):
+        self.hashes[key] = ssdeep
+        for gram in ssdeep_grams(ssdeep):
+            self._grams[gram].add(key)
+
+    def candidates(self, ssdeep):
+        """
+        Return the set of keys which ssdeep could score above zero against
+        the given hash.
+        """
+
+        found = set()
+        for gram in ssdeep_grams(ssdeep):
+            found.update(self._grams.get(gram, ()))
+        return found
+
+
+def index_document(md5, ssdeep, mimetype=None):
+    """
+    Return the raw document stored in the index for a sample, or None if
+    the ssdeep hash can not be parsed.
+    """
+
+    parsed = parse_ssdeep(ssdeep)
+    if not parsed:
+        return None
+    return {'md5': md5,
+            'ssdeep': ssdeep,
+            'mimetype': mimetype,
+            'block_size': parsed[0],
+            'grams': ssdeep_grams(ssdeep),
+            'schema_version': SSDeepIndex._meta['latest_schema_version']}
+
+
+def index_sample(md5, ssdeep, mimetype=None):
+    """
+    Add or update a sample in the index.
+    """
+
+    doc = index_document(md5, ssdeep, mimetype)
+    if doc:
+        SSDeepIndex._get_collection().update({'md5': md5}, doc, upsert=True)
+
+
+def index_status():
+    """
+    Return the SSDeepIndexStatus written when the index script last
+    completed over every Sample, or None if the index has not been built.
+    """
+
+    return SSDeepIndexStatus.objects.first()
+
+
+def mark_index_built(last_id):
+    """
+    Record that every Sample up to and including last_id has been indexed.
+    """
+
+    status = index_status() or SSDeepIndexStatus()
+    status.last_update = datetime.datetime.now()
+    if last_id:
+        status.last_id = last_id
+    status.count = SSDeepIndex.objects.count()
+    status.save()
+    return status
+
+
+def find_candidates(ssdeep, mimetype=None):
+    """
+    Return (md5, ssdeep) tuples for every indexed sample that ssdeep could
+    give a non-zero score against the given hash.
+    """
+
+    grams = ssdeep_grams(ssdeep)
+    if not grams:
+        return []
+    query = {'grams': {'$in': grams}}
+    if mimetype:
+        query['mimetype'] = mimetype
+    cursor = SSDeepIndex._get_collection().find(query, {'md5': 1, 'ssdeep': 1, '_id': 0})
+    return [(doc['md5'], doc['ssdeep']) for doc in cursor]
@@ -1,6 +1,7 @@
 import binascii
 import logging
 import os
+import tempfile
 import yara
 
 from django.conf import settings
@@ -10,6 +11,7 @@ from crits.services.core import Service, ServiceConfigError
 from crits.core.user import CRITsUser
 
 from . import forms
+from .rule_cache import rule_cache
 
 logger = logging.getLogger(__name__)
 
@@ -20,12 +22,15 @@ class YaraService(Service):
     """
 
     name = "yara"
-    version = '2.0.1'
+    version = '2.3.0'
     distributed = True
     supported_types = ['Sample']
     required_fields = ['md5']
     description = "Scan a file using Yara signatures."
 
+    # Size of the reads used when spooling large samples to disk.
+    SPOOL_CHUNK_SIZE = 1024 * 1024
+
     @staticmethod
     def parse_config(config):
         # When editing a config we are given a string.
@@ -38,7 +43,9 @@ class YaraService(Service):
         if isinstance(sigfiles, basestring):
             config['sigfiles'] = [sigfile for sigfile in sigfiles.split('\r\n')]
         # This will raise ServiceConfigError
-        YaraService._compile_rules(config['sigdir'], config['sigfiles'])
+        YaraService._compile_rules(config['sigdir'], config['sigfiles'],
+                                   config.get('cachedir'),
+                                   config.get('merge_sigfiles', False))
 
     @staticmethod
     def get_config(existing_config):
@@ -85,6 +92,7 @@ class YaraService(Service):
             del config['api_key']
             del config['distribution_url']
         del config['sigdir']
+        config.pop('cachedir', None)
 
     @staticmethod
     def _get_api_keys(config, analyst):
@@ -116,12 +124,26 @@ class YaraService(Service):
         if db_config['distribution_url'] and 'api_key' not in config:
             raise ServiceConfigError("Need API key to run.")
 
+        # Scan options not given at runtime default to the service config.
+        # The run form always submits timeout, but leaves fast_mode out when
+        # it is unchecked, so then fast_mode is off for this run.
+        if 'fast_mode' not in config:
+            if 'timeout' in config:
+                config['fast_mode'] = False
+            else:
+                config['fast_mode'] = db_config.get('fast_mode', False)
+        if config.get('timeout') is None:
+            config['timeout'] = db_config.get('timeout', 60)
+
     @staticmethod
     def bind_runtime_form(analyst, config):
         api_keys = YaraService._get_api_keys(config, analyst)
         if api_keys:
             # The api_key is a list with only one element.
             config['api_key'] = config['api_key'][0]
+        for key in ('timeout', 'fast_mode'):
+            if isinstance(config.get(key), list):
+                config[key] = config[key][0]
 
         sigfiles = YaraService._tuplize_sigfiles(config['sigfiles'])
 
@@ -143,41 +165,86 @@ class YaraService(Service):
         html = render_to_string("services_run_form.html",
                                 {'name': self.name,
                                  'form': forms.YaraRunForm(sigfiles=sigfiles,
-                                                           api_keys=api_keys),
+                                                           api_keys=api_keys,
+                                                           timeout=config.get('timeout', 60),
+                                                           fast_mode=config.get('fast_mode', False)),
                                  'crits_type': crits_type,
                                  'identifier': identifier})
         return html
 
     @staticmethod
-    def _compile_rules(sigdir, sigfiles):
+    def _compile_rules(sigdir, sigfiles, cachedir=None, merge=False):
+        """
+        Compile the signature files into a list of signature sets.
+
+        If merge is True all signature files are compiled into one rules
+        object, using the signature file name as the namespace, so that a
+        sample is only scanned once.
+        """
+
         if not sigfiles or not sigdir:
             raise ServiceConfigError("No signature files specified.")
-        sigsets = []
+        paths = []
         for sigfile in sigfiles:
             sigfile = os.path.abspath(os.path.join(sigdir, sigfile.strip()))
             logger.debug("Full path to file file: %s" % sigfile)
-            filename = os.path.basename(sigfile)
-            dirname = os.path.dirname(sigfile)
-            old = os.getcwd()
-            try:
-                with open(sigfile, "rt") as f:
-                    data = f.read()
-                    os.chdir(dirname)
-            except Exception as e:
-                logger.exception("File cannot be opened: %s" % sigfile)
-                raise ServiceConfigError(str(e))
-            try:
-                rules = yara.compile(source=data)
-            except yara.SyntaxError as e:
+            paths.append((os.path.basename(sigfile), sigfile))
+
+        sigsets = []
+        try:
+            if merge:
+                namespaces = dict(paths)
+                if len(namespaces) != len(paths):
+                    raise ServiceConfigError("Signature file names must be unique to merge them.")
+                rules = rule_cache.get_merged(namespaces, cachedir=cachedir)
+                sigsets.append({'name': None, 'rules': rules})
+            else:
+                for filename, sigfile in paths:
+                    rules = rule_cache.get(sigfile, cachedir=cachedir)
+                    sigsets.append({'name': filename, 'rules': rules})
+        except (IOError, OSError) as e:
+            logger.exception("File cannot be opened: %s" % e.filename)
+            raise ServiceConfigError(str(e))
+        except yara.SyntaxError as e:
+            if merge:
+                # yara includes the file name in the error.
+                message = "Yara rules file: %s" % str(e)
+            else:
                 message = "Yara rules file: %s: %s" % (sigfile, str(e))
-                logger.exception(message)
-                os.chdir(old)
-                raise ServiceConfigError(message)
-            sigsets.append({'name': filename, 'rules': rules})
-            os.chdir(old) 
+            logger.exception(message)
+            raise ServiceConfigError(message)
         logger.debug(str(sigsets))
         return sigsets
 
+    @staticmethod
+    def _match_strings(match):
+        """
+        Collapse the strings of a yara match into a list of dictionaries,
+        one per unique string name and data, with all of the offsets.
+        """
+
+        strings = {}
+        for s in match.strings:
+            s_name = s[1]
+            s_offset = s[0]
+            try:
+                s_data = s[2].decode('ascii')
+            except UnicodeError:
+                s_data = "Hex: " + binascii.hexlify(s[2])
+            s_key = "{0}-{1}".format(s_name, s_data)
+            if s_key in strings:
+                strings[s_key]['offset'].append(s_offset)
+            else:
+                strings[s_key] = {
+                    'offset':       [s_offset],
+                    'name':         s_name,
+                    'data':         s_data,
+                    }
+        string_list = []
+        for key in strings:
+            string_list.append(strings[key])
+        return string_list
+
     @staticmethod
     def valid_for(obj):
         if obj.filedata.grid_id == None:
@@ -239,32 +306,57 @@ class YaraService(Service):
                 return
             self._info("Submitted job to yara queue.")
         else:
-            data = obj.filedata.read()
-            sigsets = self._compile_rules(config['sigdir'], config['sigfiles'])
-            for sigset in sigsets:
+            sigsets = self._compile_rules(config['sigdir'], config['sigfiles'],
+                                          config.get('cachedir'),
+                                          config.get('merge_sigfiles', False))
+            self._debug("Rule cache hits: %(hits)d, disk hits: %(disk_hits)d, "
+                        "misses: %(misses)d" % rule_cache.stats())
+            match_args = self._match_args(config)
+            if self._is_large(obj, config):
+                # Scan large files from disk instead of holding them in memory.
+                self._info("Spooling %d bytes to disk" % obj.filedata.length)
+                with tempfile.NamedTemporaryFile(prefix='crits-yara-') as f:
+                    self._spool(obj.filedata, f)
+                    match_args['filepath'] = f.name
+                    self._scan(sigsets, config, match_args)
+            else:
+                match_args['data'] = obj.filedata.read()
+                self._scan(sigsets, config, match_args)
+            self.current_task.finish()
+
+    @staticmethod
+    def _match_args(config):
+        return {'timeout': int(config.get('timeout') or 0),
+                'fast': bool(config.get('fast_mode', False))}
+
+    @staticmethod
+    def _is_large(obj, config):
+        large_file_size = int(config.get('large_file_size') or 0) * 1024 * 1024
+        return large_file_size and obj.filedata.length > large_file_size
+
+    @classmethod
+    def _spool(cls, filedata, f):
+        chunk = filedata.read(cls.SPOOL_CHUNK_SIZE)
+        while chunk:
+            f.write(chunk)
+            chunk = filedata.read(cls.SPOOL_CHUNK_SIZE)
+        f.flush()
+
+    def _scan(self, sigsets, config, match_args):
+        for sigset in sigsets:
+            if sigset['name']:
                 logger.debug("Signature set name: %s" % sigset['name'])
                 self._info("Scanning with %s" % sigset['name'])
-                matches = sigset['rules'].match(data=data)
-                for match in matches:
-                    strings = {}
-                    for s in match.strings:
-                        s_name = s[1]
-                        s_offset = s[0]
-                        try:
-                            s_data = s[2].decode('ascii')
-                        except UnicodeError:
-                            s_data = "Hex: " + binascii.hexlify(s[2])
-                        s_key = "{0}-{1}".format(s_name, s_data)
-                        if s_key in strings:
-                            strings[s_key]['offset'].append(s_offset)
-                        else:
-                            strings[s_key] = {
-                                'offset':       [s_offset],
-                                'name':         s_name,
-                                'data':         s_data,
-                                }
-                    string_list = []
-                    for key in strings:
-                        string_list.append(strings[key])
-                    self._add_result(self.name, match.rule, {'strings': string_list})
-            self.current_task.finish()
+            else:
+                self._info("Scanning with %d signature files" % len(config['sigfiles']))
+            try:
+                matches = sigset['rules'].match(**match_args)
+            except yara.TimeoutError:
+                self._error("Scan timed out after %d seconds" % match_args['timeout'])
+                continue
+            for match in matches:
+                # When merged, the namespace is the signature file name.
+                sigfile = sigset['name'] or match.namespace
+                string_list = self._match_strings(match)
+                self._add_result(self.name, match.rule, {'strings': string_list,
+                                                         'sigfile': sigfile})
@@ -14,6 +14,29 @@ class YaraConfigForm(forms.Form):
                                widget=forms.Textarea(attrs={'cols': 40,
                                                            'rows': 6}),
                                help_text="Newline separated list of signature files.")
+    cachedir = forms.CharField(required=False,
+                               label="Compiled rule cache",
+                               initial='',
+                               widget=forms.TextInput(),
+                               help_text="Directory to store compiled rules in. Leave blank to only cache in memory.")
+    merge_sigfiles = forms.BooleanField(required=False,
+                                        label="Single pass scan",
+                                        initial=False,
+                                        help_text="Compile all signature files into one ruleset, namespaced by file name, and scan each sample once.")
+    large_file_size = forms.IntegerField(required=True,
+                                         label="Large file size",
+                                         initial=64,
+                                         min_value=0,
+                                         help_text="Size in MB above which samples are spooled to disk and scanned from there instead of memory.")
+    timeout = forms.IntegerField(required=True,
+                                 label="Scan timeout",
+                                 initial=60,
+                                 min_value=0,
+                                 help_text="Default per-scan timeout in seconds. 0 means no timeout.")
+    fast_mode = forms.BooleanField(required=False,
+                                   label="Fast mode",
+                                   initial=False,
+                                   help_text="Default to stopping at the first occurrence of each string.")
 
     distribution_url = forms.CharField(required=False,
                                        label="Distribution URL",
@@ -41,14 +64,24 @@ class YaraRunForm(forms.Form):
                                          label="Signature files",
                                          widget=forms.SelectMultiple,
                                          help_text="Signature files to use.")
+    timeout = forms.IntegerField(required=False,
+                                 label="Scan timeout",
+                                 min_value=0,
+                                 help_text="Per-scan timeout in seconds. 0 means no timeout.")
+    fast_mode = forms.BooleanField(required=False,
+                                   label="Fast mode",
+                                   help_text="Stop at the first occurrence of each string.")
 
-    def __init__(self, sigfiles=[], api_keys=[], *args, **kwargs):
+    def __init__(self, sigfiles=[], api_keys=[], timeout=60, fast_mode=False,
+                 *args, **kwargs):
         super(YaraRunForm, self).__init__(*args, **kwargs)
 
         self.fields['sigfiles'].choices = sigfiles
         # Default to all signature files.
         initial = [choice[0] for choice in sigfiles]
         self.fields['sigfiles'].initial = initial
+        self.fields['timeout'].initial = timeout
+        self.fields['fast_mode'].initial = fast_mode
 
         if api_keys:
             self.fields['api_key'] = forms.ChoiceField(widget=forms.Select,
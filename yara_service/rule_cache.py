@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import threading
+
+import yara
+
+logger = logging.getLogger(__name__)
+
+
+class RuleCache(object):
+    """
+    Process-wide cache of compiled yara rules.
+
+    Compiled rules are keyed by the absolute path of each signature file and
+    the SHA-256 of its source. The file mtime and size are used as a cheap
+    check so unchanged files are not re-read on every lookup. When a cache
+    directory is given, compiled rules are also saved to disk so a restarted
+    worker does not have to recompile.
+
+    Note that only the top level signature files are hashed. Changes to files
+    pulled in with "include" are not detected until the including file
+    itself changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._digests = {}
+        self._entries = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'entries': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._digests = {}
+            self._entries = {}
+
+    def get(self, path, cachedir=None):
+        """
+        Return compiled rules for the signature file at path.
+
+        Raises IOError if the file cannot be read and yara.SyntaxError if
+        it does not compile.
+        """
+
+        key = ((None, path, self._digest(path)),)
+        return self._get(key, cachedir)
+
+    def get_merged(self, paths, cachedir=None):
+        """
+        Return a single compiled rules object for all signature files.
+
+        paths is a dictionary of namespace to signature file path. Each file
+        is compiled into its own namespace so matches can be attributed to
+        the file they came from.
+        """
+
+        key = tuple(sorted((namespace, path, self._digest(path))
+                           for namespace, path in paths.iteritems()))
+        return self._get(key, cachedir)
+
+    def _digest(self, path):
+        st = os.stat(path)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2]
+
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with self._lock:
+            self._digests[path] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+    def _get(self, key, cachedir):
+        with self._lock:
+            rules = self._entries.get(key)
+            if rules is not None:
+                self.hits += 1
+                return rules
+
+        name = hashlib.sha256(repr(key)).hexdigest()
+        rules = self._load(name, cachedir)
+        if rules is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            rules = self._compile(key)
+            self._save(rules, name, cachedir)
+            with self._lock:
+                self.misses += 1
+
+        with self._lock:
+            # Drop rules compiled from older versions of the same files.
+            paths = set(path for (namespace, path, digest) in key)
+            for old_key in self._entries.keys():
+                if set(path for (namespace, path, digest) in old_key) == paths:
+                    del self._entries[old_key]
+            self._entries[key] = rules
+        return rules
+
+    @staticmethod
+    def _compile(key):
+        if len(key) == 1 and key[0][0] is None:
+            # Includes are resolved relative to the signature file.
+            path = key[0][1]
+            with open(path, "rt") as f:
+                source = f.read()
+            old = os.getcwd()
+            os.chdir(os.path.dirname(path))
+            try:
+                return yara.compile(source=source)
+            finally:
+                os.chdir(old)
+        filepaths = dict((namespace, path) for (namespace, path, digest) in key)
+        return yara.compile(filepaths=filepaths)
+
+    @staticmethod
+    def _cache_path(name, cachedir):
+        return os.path.join(cachedir, "%s.yarc" % name)
+
+    def _load(self, name, cachedir):
+        if not cachedir:
+            return None
+        cache_path = self._cache_path(name, cachedir)
+        if not os.path.isfile(cache_path):
+            return None
+        try:
+            return yara.load(cache_path)
+        except yara.Error as e:
+            logger.warning("Unable to load cached rules %s: %s" % (cache_path, e))
+            return None
+
+    def _save(self, rules, name, cachedir):
+        if not cachedir:
+            return
+        cache_path = self._cache_path(name, cachedir)
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        try:
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            rules.save(tmp_path)
+            # Rename so other workers never load a partial file.
+            os.rename(tmp_path, cache_path)
+        except (OSError, IOError, yara.Error) as e:
+            logger.warning("Unable to save compiled rules to %s: %s" % (cache_path, e))
+
+
+rule_cache = RuleCache()
@@ -0,0 +1,221 @@
+"""
+Scan every Sample matching a query with the yara service signatures.
+
+Example Usage:
+    python manage.py runscript yara_service sweep -- -q "{'source.name': 'FOO'}" -s new_rules.yara -w 8
+
+Sample ObjectIds are queried in batches, in ObjectId order, and handed to a
+pool of worker processes which each compile the rules once. Every worker
+reads and scans one sample at a time, spooling samples larger than the
+service 'large_file_size' to a temporary file, so file data is never held
+in the parent. The service 'timeout' and 'fast_mode' options apply to every
+scan. Results for each batch are inserted into AnalysisResult in bulk.
+Samples which fail to scan are reported and skipped. The last ObjectId of
+every completed batch is printed (and written to the checkpoint file, if one
+is given) so an interrupted sweep can be resumed with -r.
+"""
+
+import ast
+import datetime
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from optparse import OptionParser
+
+import yara
+from bson.objectid import ObjectId
+
+from crits.core.basescript import CRITsBaseScript
+from crits.samples.sample import Sample
+from crits.services.analysis_result import AnalysisResult
+from crits.services.core import ServiceConfigError
+from crits.services.handlers import get_config
+
+from yara_service import YaraService
+
+# Set once per worker process by _init_worker().
+_sigsets = None
+_config = None
+
+
+def _init_worker(sigdir, sigfiles, cachedir, merge, config):
+    global _sigsets, _config
+    _sigsets = YaraService._compile_rules(sigdir, sigfiles, cachedir, merge)
+    _config = config
+
+
+def _match(match_args):
+    results = []
+    errors = []
+    for sigset in _sigsets:
+        try:
+            matches = sigset['rules'].match(**match_args)
+        except yara.TimeoutError:
+            errors.append("Scan timed out after %d seconds" % match_args['timeout'])
+            continue
+        except yara.Error, e:
+            errors.append("Scan error: %s" % e)
+            continue
+        for match in matches:
+            results.append({'subtype': YaraService.name,
+                            'result': match.rule,
+                            'strings': YaraService._match_strings(match),
+                            'sigfile': sigset['name'] or match.namespace})
+    return (results, errors)
+
+
+def _scan(object_id):
+    """
+    Read and scan a single sample. Returns (object_id, results, errors) so
+    one bad sample never stops the sweep.
+    """
+
+    try:
+        sample = Sample.objects(id=object_id).only('id', 'filedata').first()
+        if not sample or sample.filedata.grid_id == None:
+            return (object_id, [], [])
+        match_args = YaraService._match_args(_config)
+        if YaraService._is_large(sample, _config):
+            with tempfile.NamedTemporaryFile(prefix='crits-yara-') as f:
+                YaraService._spool(sample.filedata, f)
+                match_args['filepath'] = f.name
+                (results, errors) = _match(match_args)
+        else:
+            match_args['data'] = sample.filedata.read()
+            (results, errors) = _match(match_args)
+    except Exception, e:
+        return (object_id, [], ["%s: %s" % (e.__class__.__name__, e)])
+    return (object_id, results, errors)
+
+
+class CRITsScript(CRITsBaseScript):
+    def __init__(self, username=None):
+        self.username = username
+
+    def _config_value(self, sc, key, default):
+        # Options added in later service versions may not be in the config.
+        try:
+            return sc[key]
+        except KeyError:
+            return default
+
+    def _read_batch(self, query, last_id, size):
+        if last_id:
+            query = {'$and': [query, {'_id': {'$gt': last_id}}]}
+        return [sample.id for sample in
+                Sample.objects(__raw__=query).order_by('+id').only('id')[:size]]
+
+    def _save_results(self, results, start_date):
+        finish_date = str(datetime.datetime.now())
+        docs = []
+        for object_id, matches, errors in results:
+            if not matches:
+                continue
+            docs.append(AnalysisResult(analyst=self.username,
+                                       analysis_id=uuid.uuid4(),
+                                       service_name=YaraService.name,
+                                       version=YaraService.version,
+                                       distributed=False,
+                                       start_date=start_date,
+                                       finish_date=finish_date,
+                                       status='completed',
+                                       object_type='Sample',
+                                       object_id=str(object_id),
+                                       results=matches))
+        if docs:
+            AnalysisResult.objects.insert(docs, load_bulk=False)
+        return len(docs)
+
+    def run(self, argv):
+        parser = OptionParser()
+        parser.add_option("-q", "--query", action="store", dest="query",
+                type="string", default="{}", help="query filter")
+        parser.add_option("-s", "--sigfiles", action="store", dest="sigfiles",
+                type="string", help="comma separated signature files (default: service config)")
+        parser.add_option("-w", "--workers", action="store", dest="workers",
+                type="int", default=multiprocessing.cpu_count(),
+                help="number of worker processes")
+        parser.add_option("-b", "--batch", action="store", dest="batch",
+                type="int", default=500, help="samples per batch")
+        parser.add_option("-r", "--resume", action="store", dest="resume",
+                type="string", help="ObjectId to resume after")
+        parser.add_option("-c", "--checkpoint", action="store", dest="checkpoint",
+                type="string", help="file to store the last completed ObjectId in")
+        parser.add_option("-m", "--merge", action="store_true", dest="merge",
+                default=False, help="compile all signature files into one ruleset")
+        (opts, args) = parser.parse_args(argv)
+
+        try:
+            query = ast.literal_eval(opts.query)
+        except Exception, e:
+            print "Error with query: %s" % e
+            return
+
+        sc = get_config(YaraService.name)
+        sigdir = str(sc['sigdir'])
+        if opts.sigfiles:
+            sigfiles = opts.sigfiles.split(',')
+        else:
+            sigfiles = sc['sigfiles']
+        merge = opts.merge or self._config_value(sc, 'merge_sigfiles', False)
+        cachedir = self._config_value(sc, 'cachedir', None) or None
+        config = {'timeout': self._config_value(sc, 'timeout', 0),
+                  'fast_mode': self._config_value(sc, 'fast_mode', False),
+                  'large_file_size': self._config_value(sc, 'large_file_size', 0)}
+
+        # Compile once up front so rule errors are reported before forking.
+        try:
+            YaraService._compile_rules(sigdir, sigfiles, cachedir, merge)
+        except ServiceConfigError, e:
+            print "Error with rules: %s" % e
+            return
+
+        last_id = None
+        if opts.resume:
+            last_id = ObjectId(opts.resume)
+        elif opts.checkpoint and os.path.isfile(opts.checkpoint):
+            with open(opts.checkpoint) as f:
+                last_id = ObjectId(f.read().strip())
+        if last_id:
+            print "[+] Resuming after %s" % last_id
+
+        pool = multiprocessing.Pool(opts.workers, _init_worker,
+                                    (sigdir, sigfiles, cachedir, merge, config))
+        start_date = str(datetime.datetime.now())
+        start = time.time()
+        scanned = 0
+        hits = 0
+        failed = 0
+        try:
+            while True:
+                batch = self._read_batch(query, last_id, opts.batch)
+                if not batch:
+                    break
+                # imap returns results in batch order, so once the loop is
+                # done every sample up to the end of the batch is scanned.
+                results = []
+                for result in pool.imap(_scan, batch):
+                    (object_id, matches, errors) = result
+                    for error in errors:
+                        print "[-] %s: %s" % (object_id, error)
+                    if errors:
+                        failed += 1
+                    results.append(result)
+                hits += self._save_results(results, start_date)
+                scanned += len(batch)
+                last_id = batch[-1]
+                if opts.checkpoint:
+                    with open(opts.checkpoint, 'w') as f:
+                        f.write(str(last_id))
+                elapsed = time.time() - start
+                print "[+] %d samples, %d with hits, %d with errors, %.1f samples/sec, last: %s" % (
+                    scanned, hits, failed, scanned / elapsed if elapsed else 0, last_id)
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+        pool.close()
+        pool.join()
+        print "[+] Done"
@@ -1,5 +1,12 @@
+from collections import OrderedDict
+
+from django.template.loader import render_to_string
+
 from crits.services.core import Service, ServiceConfigError
 from zip_meta import ZipParser
+from zip_members import MemberWriter
+
+from . import forms
 
 class ZipMetaService(Service):
     """
@@ -7,10 +14,47 @@ class ZipMetaService(Service):
     """
 
     name = "zip_meta"
-    version = '1.0.0'
+    version = '1.2.0'
     description = "Generate metadata from zip files."
     supported_types = ['Sample']
 
+    # Upper bounds of the compression ratio histogram buckets.
+    RATIO_BUCKETS = [1, 2, 5, 10, 100, 1000]
+
+    @staticmethod
+    def get_config(existing_config):
+        # Generate default config from form and initial values.
+        config = {}
+        fields = forms.ZipMetaConfigForm().fields
+        for name, field in fields.iteritems():
+            config[name] = field.initial
+
+        # If there is a config in the database, use values from that.
+        if existing_config:
+            for key, value in existing_config.iteritems():
+                config[key] = value
+        return config
+
+    @staticmethod
+    def get_config_details(config):
+        display_config = {}
+
+        # Rename keys so they render nice.
+        fields = forms.ZipMetaConfigForm().fields
+        for name, field in fields.iteritems():
+            display_config[field.label] = config[name]
+
+        return display_config
+
+    @classmethod
+    def generate_config_form(self, config):
+        html = render_to_string('services_config_form.html',
+                                {'name': self.name,
+                                 'form': forms.ZipMetaConfigForm(initial=config),
+                                 'config_error': None})
+        form = forms.ZipMetaConfigForm
+        return form, html
+
     @staticmethod
     def valid_for(obj):
         # Only run on zip files
@@ -27,40 +71,122 @@ class ZipMetaService(Service):
         if data[:4] not in [ZipParser.zipLDMagic, ZipParser.zipCDMagic]:
             raise ServiceConfigError("Not a zip file.")
 
+    def ratio_buckets(self):
+        lower = 0
+        for upper in self.RATIO_BUCKETS:
+            yield "%d-%d" % (lower, upper)
+            lower = upper
+        yield ">=%d" % lower
+
+    def ratio_bucket(self, ratio):
+        lower = 0
+        for upper in self.RATIO_BUCKETS:
+            if ratio < upper:
+                return "%d-%d" % (lower, upper)
+            lower = upper
+        return ">=%d" % lower
+
     def run(self, obj, config):
+        max_members = config.get('max_members', 100)
+        ratio_threshold = config.get('ratio_threshold', 100)
+        writer = None
+        if config.get('save_members'):
+            writer = MemberWriter(obj.md5)
+
         zparser = ZipParser(obj.filedata.read())
-        parsedZip =  zparser.parseZipFile()
-        if not parsedZip:
+        if not zparser.data.startswith(ZipParser.zipCDMagic, zparser.cdStart):
             self._error("Could not parse document as a zip file")
             return
-        for cd in parsedZip:
-            for name,value in cd.iteritems():
-                if name == 'ZipExtraField':
-                    continue
-                name = {"Name" : name}
-                if type(value) is list or type(value) is tuple:
-                    for element in value:
-                        self._add_result(cd["ZipFileName"], str(element), name)
-                # Add way to handle dictionary.
-                #if type(value) is dict: ...
-                else:
-                    self._add_result(cd["ZipFileName"], str(value), name)
-            if cd["ZipExtraField"]:
-                for dictionary in cd["ZipExtraField"]:
-                    if dictionary["Name"] == "UnknownHeader":
-                        for name,value in dictionary.iteritems():
-                            name = {"Name" : name}
-                            if name == "Data":
-                                self._add_result(dictionary["Name"], name, name)
-                            else:
-                                self._add_result(dictionary["Name"], str(value), name)
-                    else:
-                        for name,value in dictionary.iteritems():
-                            name = {"Name" : name}
-                            self._add_result(dictionary["Name"], str(value), name)
+
+        members = 0
+        encrypted = 0
+        compressed_total = 0
+        uncompressed_total = 0
+        histogram = OrderedDict((bucket, 0) for bucket in self.ratio_buckets())
+        outliers = []
+        names = {}
+        for cd in zparser.iterZipFile():
+            if not max_members or members < max_members:
+                self._add_member_results(cd)
+            is_encrypted = "Encrypted File" in (cd["ZipBitFlag"] or [])
+            if is_encrypted:
+                encrypted += 1
+            names[cd["ZipFileName"]] = names.get(cd["ZipFileName"], 0) + 1
+            compressed = cd["ZipCompressedSize"]
+            uncompressed = cd["ZipUncompressedSize"]
+            ratio = None
+            # Zip64 sizes are a note pointing at the extra field.
+            if isinstance(compressed, (int, long)) and isinstance(uncompressed, (int, long)):
+                compressed_total += compressed
+                uncompressed_total += uncompressed
+                if compressed > 0:
+                    ratio = float(uncompressed) / compressed
+                    histogram[self.ratio_bucket(ratio)] += 1
+                    if ratio >= ratio_threshold:
+                        outliers.append((ratio, cd["ZipFileName"], compressed, uncompressed))
+            if writer:
+                writer.add(members, cd, ratio, is_encrypted)
+            members += 1
+        if writer:
+            writer.flush()
+
+        if max_members and members > max_members:
+            self._info("Per-member results limited to the first %d of %d members"
+                       % (max_members, members))
+        self._add_result("ZipSummary", str(members), {"Name": "Members"})
+        self._add_result("ZipSummary", str(min(members, max_members or members)),
+                         {"Name": "DetailedMembers"})
+        self._add_result("ZipSummary", str(encrypted), {"Name": "EncryptedMembers"})
+        self._add_result("ZipSummary", str(compressed_total), {"Name": "CompressedSize"})
+        self._add_result("ZipSummary", str(uncompressed_total), {"Name": "UncompressedSize"})
+        if compressed_total:
+            self._add_result("ZipSummary", "%.1f" % (float(uncompressed_total) / compressed_total),
+                             {"Name": "CompressionRatio"})
+        duplicates = sorted([(count, name) for (name, count) in names.iteritems() if count > 1],
+                            reverse=True)
+        self._add_result("ZipSummary", str(len(duplicates)), {"Name": "DuplicateNames"})
+        if writer:
+            self._add_result("ZipSummary", str(writer.count), {"Name": "SavedMembers"})
+        for (bucket, count) in histogram.iteritems():
+            self._add_result("ZipRatioHistogram", str(count), {"Name": bucket})
+        # Report the worst outliers and duplicates, each list is capped
+        # like the per-member results.
+        outliers.sort(reverse=True)
+        for (ratio, name, compressed, uncompressed) in outliers[:max_members or None]:
+            self._add_result("ZipRatioOutlier", str(name), {"Name": "%.1f" % ratio,
+                                                           "CompressedSize": compressed,
+                                                           "UncompressedSize": uncompressed})
+        for (count, name) in duplicates[:max_members or None]:
+            self._add_result("ZipDuplicateName", str(name), {"Name": str(count)})
+
+    def _add_member_results(self, cd):
+        for name,value in cd.iteritems():
+            if name == 'ZipExtraField':
+                continue
+            name = {"Name" : name}
+            if type(value) is list or type(value) is tuple:
+                for element in value:
+                    self._add_result(cd["ZipFileName"], str(element), name)
+            # Add way to handle dictionary.
+            #if type(value) is dict: ...
             else:
-                name = {"Name" : "ExtraField"}
-                self._add_result(cd["ZipFileName"], "None", name)
+                self._add_result(cd["ZipFileName"], str(value), name)
+        if cd["ZipExtraField"]:
+            for dictionary in cd["ZipExtraField"]:
+                if dictionary["Name"] == "UnknownHeader":
+                    for name,value in dictionary.iteritems():
+                        name = {"Name" : name}
+                        if name == "Data":
+                            self._add_result(dictionary["Name"], name, name)
+                        else:
+                            self._add_result(dictionary["Name"], str(value), name)
+                else:
+                    for name,value in dictionary.iteritems():
+                        name = {"Name" : name}
+                        self._add_result(dictionary["Name"], str(value), name)
+        else:
+            name = {"Name" : "ExtraField"}
+            self._add_result(cd["ZipFileName"], "None", name)
 
     def _parse_error(self, item, e):
         self._error("Error parsing %s (%s): %s" % (item, e.__class__.__name__, e))
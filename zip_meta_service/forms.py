@@ -0,0 +1,22 @@
+from django import forms
+
+class ZipMetaConfigForm(forms.Form):
+    error_css_class = 'error'
+    required_css_class = 'required'
+    max_members = forms.IntegerField(required=True,
+                                     label="Detailed members",
+                                     initial=100,
+                                     min_value=0,
+                                     help_text="Number of members to add per-member results for. Larger archives are summarised. 0 means no limit.")
+    ratio_threshold = forms.IntegerField(required=True,
+                                         label="Suspicious ratio",
+                                         initial=100,
+                                         min_value=1,
+                                         help_text="Compression ratio at or above which a member is reported as a possible zip bomb.")
+    save_members = forms.BooleanField(required=False,
+                                      label="Save all members",
+                                      initial=False,
+                                      help_text="Store the central directory entry of every member in the zip_members collection.")
+
+    def __init__(self, *args, **kwargs):
+        super(ZipMetaConfigForm, self).__init__(*args, **kwargs)
@@ -0,0 +1,88 @@
+from mongoengine import Document, StringField, IntField, FloatField, BooleanField
+
+from crits.core.crits_mongoengine import CritsDocument
+
+
+class ZipMember(CritsDocument, Document):
+    """Zip archive member Document Object"""
+    meta = {
+        "collection": 'zip_members',
+        "crits_type": 'zip_members',
+        "latest_schema_version": 1,
+        "schema_doc": {
+            'md5': "MD5 of the zip archive",
+            'index': "Position of the member in the central directory",
+            'name': "File name",
+            'compressed_size': "Compressed size",
+            'uncompressed_size': "Uncompressed size",
+            'ratio': "Uncompressed size divided by compressed size",
+            'crc': "CRC-32",
+            'compression': "Compression method",
+            'encrypted': "Encrypted flag is set",
+            'modify_date': "Modification date",
+        },
+        "indexes": [
+            ('md5', 'index'),
+            'name',
+        ],
+    }
+
+    md5 = StringField(required=True)
+    index = IntField(required=True)
+    name = StringField()
+    compressed_size = IntField()
+    uncompressed_size = IntField()
+    ratio = FloatField()
+    crc = StringField()
+    compression = StringField()
+    encrypted = BooleanField()
+    modify_date = StringField()
+
+    def migrate(self):
+        pass
+
+
+class MemberWriter(object):
+    """
+    Store the members of an archive in batches as they are parsed, replacing
+    any stored by an earlier run.
+    """
+
+    def __init__(self, md5, batch_size=1000):
+        self.md5 = md5
+        self.batch_size = batch_size
+        self.batch = []
+        self.count = 0
+        self.collection = ZipMember._get_collection()
+        self.collection.remove({'md5': md5})
+
+    @staticmethod
+    def size(value):
+        # Sizes which did not fit are a note pointing at the zip64 extra field
+        if isinstance(value, (int, long)):
+            return value
+        return None
+
+    def add(self, index, member, ratio, encrypted):
+        name = member['ZipFileName']
+        self.batch.append({
+            'md5': self.md5,
+            'index': index,
+            'name': name.decode('utf-8', 'replace') if name else None,
+            'compressed_size': self.size(member['ZipCompressedSize']),
+            'uncompressed_size': self.size(member['ZipUncompressedSize']),
+            'ratio': ratio,
+            'crc': member['ZipCRC'],
+            'compression': member['ZipCompression'],
+            'encrypted': encrypted,
+            'modify_date': member['ZipModifyDate'],
+            'schema_version': ZipMember._meta['latest_schema_version'],
+        })
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.collection.insert(self.batch)
+            self.count += len(self.batch)
+            self.batch = []
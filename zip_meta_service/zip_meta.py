@@ -1,33 +1,72 @@
 import struct
 import binascii
+from collections import namedtuple
 from datetime import datetime
 from pprint import pprint
 import extra_field_parse
 
+# Fixed size part of a central directory record (46 bytes)
+CDRecord = namedtuple('CDRecord', ['signature', 'versionMadeBy', 'madeByHost',
+    'requiredVersion', 'flags', 'method', 'dateTime', 'crc', 'compressedSize',
+    'uncompressedSize', 'fileNameLength', 'extraFieldLength', 'commentLength',
+    'startDisk', 'internalAttributes', 'externalAttributes', 'relativeOffset'])
+
+# End of central directory record (22 bytes)
+EndRecord = namedtuple('EndRecord', ['signature', 'numberOfDisk', 'startOfCDDisk',
+    'numberOfCDs', 'totalNumberOfCDs', 'cdSize', 'cdStartOffset', 'commentLength'])
+
 #Parse Zip Central Directory
 class ZipParser():
 
     zipLDMagic = "\x50\x4b\x03\x04" #Local Directory
     zipCDMagic = "\x50\x4b\x01\x02" #Central Directory
+    zipEndMagic = "\x50\x4b\x05\x06" #End Of Central Directory
+    zip64EndMagic = "\x50\x4b\x06\x06" #Zip64 End Of Central Directory
+    zip64LocatorMagic = "\x50\x4b\x06\x07" #Zip64 End Of Central Directory Locator
+
+    cdStruct = struct.Struct("<4sBBHHHI4sIIHHHHHII")
+    endStruct = struct.Struct("<4sHHHHIIH")
+    # Signature, record size, versions, disk numbers, number of entries on
+    # this disk and in total, then the size and offset of the central directory
+    zip64EndStruct = struct.Struct("<4sQHHIIQQQQ")
+    # Signature, disk number, offset of the zip64 end record, number of disks
+    zip64LocatorStruct = struct.Struct("<4sIQI")
+    shortStruct = struct.Struct("<H")
+
+    # The end record comment is at most this long
+    maxCommentLength = 0xFFFF
+
+    efMappings = extra_field_parse.HeaderIdMapping().HeaderIds()
+
+    def unpackFrom(self, structure, offset, end):
+        # Same as unpacking a slice of data ending at end
+        if offset < 0 or offset + structure.size > end:
+            raise struct.error("unpack requires a string argument of length %d" % structure.size)
+        return structure.unpack_from(self.data, offset)
+
+    def getRecordField(self, start, length):
+        #Variable length field of the current central directory record
+        start += self.recordOffset
+        return self.data[start:min(start + length, self.cdEnd)]
 
     def getFileComment(self):
         if self.getCommentLength() == 0:
             return None
         startPosition = (46 + self.getFileNameLength() + self.getExtraFieldCDLength())
-        return self.centralDirectory[startPosition:(startPosition + self.getCommentLength())]
+        return self.getRecordField(startPosition, self.getCommentLength())
 
     def getCommentLength(self):
-        return struct.unpack("<H",self.centralDirectory[32:34])[0]
+        return self.record.commentLength
 
     def parseExtraField(self,extraField):
         parsedExtraField = []
-        efParser = extra_field_parse.HeaderIdMapping()
-        efMappings = efParser.HeaderIds()
-        while extraField:
-            blockMagic = extraField[0:2]
-            blockSize = struct.unpack("<H", extraField[2:4])[0]
-            efBlock = extraField[:4+blockSize]
-            if blockMagic in efMappings.keys():
+        efMappings = self.efMappings
+        position = 0
+        while position < len(extraField):
+            blockMagic = extraField[position:position + 2]
+            blockSize = struct.unpack("<H", extraField[position + 2:position + 4])[0]
+            efBlock = extraField[position:position + 4 + blockSize]
+            if blockMagic in efMappings:
                 #Mapping Header Is known (may or may not have been parsed)
                 parser = efMappings[blockMagic]["parseField"]()
                 parsedExtraField.append(parser.parse(efBlock,self.zip64Flag))
@@ -35,50 +74,46 @@ class ZipParser():
                 #No Header Hits
                 parser = efMappings["Unknown"]["parseField"]()
                 parsedExtraField.append(parser.parse(efBlock, self.zip64Flag))
-            extraField = extraField[4+blockSize:]
+            position += 4 + blockSize
         return parsedExtraField
 
-    def getExtraField(self):
-        if self.getExtraFieldLDLength() == 0:
-            return None
+    def getLocalOffset(self):
+        offset = self.record.relativeOffset
         #Handler for case where offset cannot be found in central Directory
-        if self.zip64Flag["offsetZip64"]:
+        if offset == 0xFFFFFFFF:
             #If Offset flag present use central directory to find offset in extrafield
-            startPosition = (46 + self.getFileNameLength())
-            extraField = self.centralDirectory[startPosition:(startPosition + self.getExtraFieldCDLength())]
-
-            efParser = extra_field_parse.HeaderIdMapping()
-            efMappings = efParser.HeaderIds()
-
+            extraField = self.getRecordField(46 + self.getFileNameLength(),
+                                             self.getExtraFieldCDLength())
             start = extraField.find("\x01\x00")
-            blockMagic = extraField[start:start + 2]
+            if start < 0:
+                return None
             blockSize = struct.unpack("<H", extraField[start + 2:start + 4])[0]
-            parser = efMappings[blockMagic]["parseField"]()
+            efBlock = extraField[start:start + 4 + blockSize]
+            parser = self.efMappings["\x01\x00"]["parseField"]()
             zip64 = parser.parse(efBlock,self.zip64Flag)
-            offset = zip64["RelativeOffset"]
+            offset = zip64.get("RelativeOffset")
+        return offset
 
-            startPosition = (offset + 30 + self.getFileNameLength())
-            extraField = self.localDirectory[startPosition:(startPosition + self.getExtraFieldLDLength())]
-        else:
-            startPosition = (self.getRelativeOffset() + 30 + self.getFileNameLength())
-            extraField = self.localDirectory[startPosition:(startPosition + self.getExtraFieldLDLength())]
-        return self.parseExtraField(extraField)
+    def getExtraField(self):
+        offset = self.getLocalOffset()
+        if offset is None or self.getExtraFieldLDLength(offset) == 0:
+            return None
+        startPosition = (offset + 30 + self.getFileNameLength())
+        endPosition = min(startPosition + self.getExtraFieldLDLength(offset), self.cdStart)
+        return self.parseExtraField(self.data[startPosition:endPosition])
 
     def getExtraFieldCDLength(self): #Central Directory
-        length = struct.unpack("<H", self.centralDirectory[30:32])[0]
-        return length
+        return self.record.extraFieldLength
 
-    def getExtraFieldLDLength(self): #Local Directory
-        length = struct.unpack("<H", self.localDirectory[self.getRelativeOffset()
-                                +28:self.getRelativeOffset()+30])[0]
-        return length
+    def getExtraFieldLDLength(self, offset): #Local Directory
+        return self.unpackFrom(self.shortStruct, offset + 28, self.cdStart)[0]
 
     def getModifyDate(self):
         #MS-DOS Epoch
-        if struct.unpack("<I",self.centralDirectory[12:16])[0] == 0:
+        if self.record.dateTime == 0:
             return None
         else:
-            dateTime = struct.unpack("<I",self.centralDirectory[12:16])[0]
+            dateTime = self.record.dateTime
         secs  = (dateTime & 0x1F) * 2
         mins  = (dateTime & 0x7E0) >> 5
         hours = (dateTime & 0xF800) >> 11
@@ -90,28 +125,30 @@ class ZipParser():
     def getFileName(self):
         if self.getFileNameLength() == 0:
             return None
-        return self.centralDirectory[46:(46 + self.getFileNameLength())]
+        return self.getRecordField(46, self.getFileNameLength())
 
     def getFileNameLength(self):
-        return struct.unpack("<H",self.centralDirectory[28:30])[0]
+        return self.record.fileNameLength
 
     def getRelativeOffset(self):
-        if struct.unpack("<I",self.centralDirectory[42:46])[0] == 0xFFFFFFFF:
+        if self.record.relativeOffset == 0xFFFFFFFF:
             self.zip64Flag["offsetZip64"] = True
             return "Zip 64. See Extra Field For Relative Offset"
-        return struct.unpack("<I",self.centralDirectory[42:46])[0]
+        return self.record.relativeOffset
 
     def getFileExternalAttributes(self):
-        return struct.unpack("<I",self.centralDirectory[38:42])[0]
+        return self.record.externalAttributes
+
+    internalNames = {
+    0:    "ASCII/text file",
+    1:    "reserved",                                       #pkware reserved
+    2:    "control field records precede logical records",  #pkware reserved
+    3:    "unused"
+    }
 
     def getInternalAttributeNames(self,bit):
-        internalNames = {
-        0:    "ASCII/text file",
-        1:    "reserved",                                       #pkware reserved
-        2:    "control field records precede logical records",  #pkware reserved
-        3:    "unused"
-        }
-        if bit in xrange(3,16):
+        internalNames = self.internalNames
+        if 3 <= bit < 16:
             return internalNames[3]
         elif bit in internalNames:
             return internalNames[bit]
@@ -119,7 +156,9 @@ class ZipParser():
             return "{} Is An Unknown Internal Attribute".format(bit)
 
     def getInternalAttributes(self):
-        internalAttributes = struct.unpack("<H",self.centralDirectory[36:38])[0]
+        internalAttributes = self.record.internalAttributes
+        if internalAttributes == 0:
+            return None
         setAttributes = []
         for bit in xrange(0,16):
             if internalAttributes & (2**bit) > 0:
@@ -129,26 +168,24 @@ class ZipParser():
         return setAttributes
 
     def getFileStartDisk(self):
-        if struct.unpack("<H",self.centralDirectory[34:36])[0] == 0xFFFF:
+        if self.record.startDisk == 0xFFFF:
             self.zip64Flag["diskZip64"] = True
             return "Zip 64. See Extra Field For File Start Disk"
-        return struct.unpack("<H",self.centralDirectory[34:36])[0]
+        return self.record.startDisk
 
     def getCompressedSize(self):
-        if struct.unpack("<I",self.centralDirectory[20:24])[0] == 0xFFFFFFFF:
+        if self.record.compressedSize == 0xFFFFFFFF:
              self.zip64Flag["cZip64"] = True
              return "Zip 64. See Extra Field For Compressed Size"
-        return struct.unpack("<I",self.centralDirectory[20:24])[0]
+        return self.record.compressedSize
 
     def getUncompressedSize(self):
-        if struct.unpack("<I",self.centralDirectory[24:28])[0] == 0xFFFFFFFF:
+        if self.record.uncompressedSize == 0xFFFFFFFF:
             self.zip64Flag["ucZip64"] = True
             return "Zip 64. See Extra Field For Uncompressed Size"
-        return struct.unpack("<I",self.centralDirectory[24:28])[0]
+        return self.record.uncompressedSize
 
-    def compressionMethodName(self):
-        method = struct.unpack("<H",self.centralDirectory[10:12])[0]
-        compMethods = {
+    compMethods = {
         0:      "No Compression/Stored",
         1:      "Shrunk",
         2:      "Reduced With Compression Factor 1",
@@ -171,16 +208,19 @@ class ZipParser():
         19:     "IBM LZ77 Z",
         98:     "PPMD Version I, Revision 1"
         }
+
+    def compressionMethodName(self):
+        method = self.record.method
+        compMethods = self.compMethods
         if method in compMethods:
             return compMethods[method]
         else:
             return "{} Is An Unknown Compression Method".format(method)
 
     def getCRC(self):
-        return binascii.hexlify(self.centralDirectory[16:20])
+        return binascii.hexlify(self.record.crc)
 
-    def getFlagNames(self,flag):
-        flagNames = {
+    flagNames = {
         0:  "Encrypted File",
         1:  "Compression Option",
         2:  "Compression Option",
@@ -198,13 +238,18 @@ class ZipParser():
         14: "Reserved",
         15: "Reserved"
         }
+
+    def getFlagNames(self,flag):
+        flagNames = self.flagNames
         if flag in flagNames:
             return flagNames[flag]
         else:
             return "{} Is An Unknown Flag Name".format(flag)
 
     def getFlags(self):
-        flags = struct.unpack("<H",self.centralDirectory[8:10])[0]
+        flags = self.record.flags
+        if flags == 0:
+            return None
         setFlags = []
         for i in xrange(0,16):
         	if (flags & (2**i)):
@@ -214,10 +259,9 @@ class ZipParser():
         return setFlags
 
     def getRequiredVersion(self):
-        return (struct.unpack("<H",self.centralDirectory[6:8])[0] * .1)
+        return (self.record.requiredVersion * .1)
 
-    def getVersionMadeByName(self,highByte):
-        versionNameDict = {
+    versionNameDict = {
         0   :"MS:DOS and OS/2 (FAT / VFAT / FAT32 file systems)",
         1   :"Amiga",
         2   :"OpenVMS",
@@ -240,7 +284,10 @@ class ZipParser():
         19  :"OS/X (Darwin)",
         20  :"unused",
         }
-        if highByte in xrange(20,256):
+
+    def getVersionMadeByName(self,highByte):
+        versionNameDict = self.versionNameDict
+        if 20 <= highByte < 256:
             return versionNameDict[20]
         elif highByte in versionNameDict:
             return versionNameDict[highByte]
@@ -248,10 +295,17 @@ class ZipParser():
             return "{} Is An Unknown Version Name".format(highByte)
 
     def getVersionMadeBy(self):#MOD THIS FOR MINOR
-        versionBytes = (struct.unpack("<BB",self.centralDirectory[4:6]))
-        return self.getVersionMadeByName(versionBytes[1]), (float(versionBytes[0]) * .1)
+        return self.getVersionMadeByName(self.record.madeByHost), (float(self.record.versionMadeBy) * .1)
 
-    def parseCentralDirectory(self):
+    def parseCentralDirectory(self, offset):
+        self.recordOffset = offset
+        self.record = CDRecord._make(self.cdStruct.unpack_from(self.data, offset))
+        # Flags needed to denote a zip64 file type
+        self.zip64Flag = {"ucZip64"     : False,
+                          "cZip64"      : False,
+                          "offsetZip64" : False,
+                          "diskZip64"   : False
+                          }
         centralDirectory = {
         "VersionMadeBy"             :self.getVersionMadeBy(),
         "ZipRequiredVersion"        :self.getRequiredVersion(),      #to extract
@@ -272,19 +326,32 @@ class ZipParser():
 
         return centralDirectory
 
+    def iterCentralDirectory(self):
+        #Yields the offset of every central directory record. Records are
+        #walked by their declared lengths; only if a record does not end
+        #where the next one starts is the next signature searched for.
+        offset = self.cdStart
+        while offset + 46 <= self.cdEnd and self.data.startswith(self.zipCDMagic, offset):
+            yield offset
+            (fileNameLength, extraFieldLength, commentLength) = struct.unpack_from("<HHH", self.data, offset + 28)
+            nextOffset = offset + 46 + fileNameLength + extraFieldLength + commentLength
+            if not self.data.startswith(self.zipCDMagic, nextOffset):
+                nextOffset = self.data.find(self.zipCDMagic, offset + 4, self.cdEnd)
+                if nextOffset < 0:
+                    break
+            offset = nextOffset
+
+    def iterZipFile(self):
+        for offset in self.iterCentralDirectory():
+            yield self.parseCentralDirectory(offset)
+
     def parseZipFile(self):
         #Because a central directory is an extended version of a local
         #directory and thus, contains more data, we parse it rather than
         #the local directory.
-        if not self.centralDirectory.startswith(self.zipCDMagic):
+        if not self.data.startswith(self.zipCDMagic, self.cdStart):
             return None
-        start = 1
-        parsedFiles = []
-        while start > 0:
-            parsedFiles.append(self.parseCentralDirectory())
-            start = self.centralDirectory[1:].find(self.zipCDMagic) +1
-            self.centralDirectory = self.centralDirectory[start:]
-        return parsedFiles
+        return list(self.iterZipFile())
 
 #***************************END**DIRECTORY**PARSING*****************************
 
@@ -292,35 +359,69 @@ class ZipParser():
         return self.data[0:4]
 
     def getCDComment(self):
-        if self.endDirectory[22:(22 + self.getCDCommentLength())] == 0:
+        if self.getCDCommentLength() == 0:
             return None
-        else:
-            return self.endDirectory[22:(22 + self.getCDCommentLength())]
+        start = self.endOffset + 22
+        return self.data[start:(start + self.getCDCommentLength())]
 
     def getCDCommentLength(self):
-        return struct.unpack("<H",self.endDirectory[20:22])[0]
+        return self.endDirectory.commentLength
 
     def getCDStartOffset(self):
-        return struct.unpack("<I",self.endDirectory[16:20])[0]
+        return self.endDirectory.cdStartOffset
 
     def getSizeOfCD(self):
-        return struct.unpack("<I",self.endDirectory[12:16])[0]
+        return self.endDirectory.cdSize
 
     def getTotalNumberOfCDs(self):
-        return struct.unpack("<H",self.endDirectory[10:12])[0]
+        return self.endDirectory.totalNumberOfCDs
 
     def getNumberOfCDs(self): #On Disk
-        return struct.unpack("<H",self.endDirectory[8:10])[0]
+        return self.endDirectory.numberOfCDs
 
     def getStartOfCDDisk(self):
-        return struct.unpack("<H",self.endDirectory[6:8])[0]
+        return self.endDirectory.startOfCDDisk
 
     def getNumberOfDisk(self):
-        return struct.unpack("<H",self.endDirectory[4:6])[0]
+        return self.endDirectory.numberOfDisk
+
+    def findEndDirectory(self):
+        #Search backwards from the end of the file, the end record is
+        #followed by nothing but its comment. If no record fits exactly
+        #(data appended to the zip file) the last one found is used.
+        lowest = max(0, len(self.data) - 22 - self.maxCommentLength)
+        offset = self.data.rfind(self.zipEndMagic, lowest)
+        last = None
+        while offset >= 0:
+            if offset + 22 <= len(self.data):
+                if last is None:
+                    last = offset
+                commentLength = self.shortStruct.unpack_from(self.data, offset + 20)[0]
+                if offset + 22 + commentLength == len(self.data):
+                    return offset
+            offset = self.data.rfind(self.zipEndMagic, lowest, offset)
+        return last
+
+    def readZip64EndDirectory(self):
+        #Replace the sizes and offsets of the end record which did not fit
+        #with the ones in the zip64 end record, if there is one.
+        locator = self.endOffset - self.zip64LocatorStruct.size
+        if locator < 0 or not self.data.startswith(self.zip64LocatorMagic, locator):
+            return
+        endOffset = self.zip64LocatorStruct.unpack_from(self.data, locator)[2]
+        if endOffset + self.zip64EndStruct.size > locator or not self.data.startswith(self.zip64EndMagic, endOffset):
+            return
+        zip64End = self.zip64EndStruct.unpack_from(self.data, endOffset)
+        self.endDirectory = self.endDirectory._replace(numberOfDisk=zip64End[4],
+                                                       startOfCDDisk=zip64End[5],
+                                                       numberOfCDs=zip64End[6],
+                                                       totalNumberOfCDs=zip64End[7],
+                                                       cdSize=zip64End[8],
+                                                       cdStartOffset=zip64End[9])
 
     def parseEndDirectory(self):
-        start = self.data.find("\x50\x4b\x05\x06")
-        self.endDirectory = self.data[start:]
+        if self.endDirectory is None:
+            return None
         endDirectoryDict = {
         "NumberOfDisk"              :self.getNumberOfDisk(),
         "StartOfCDDisk"             :self.getStartOfCDDisk(),
@@ -336,10 +437,20 @@ class ZipParser():
 
     def __init__(self,data):
         self.data = data
-        cdStart = self.parseEndDirectory()["CDStartOffset"]
-        cdEnd = cdStart + self.parseEndDirectory()["CDSize"]
-        self.localDirectory = data[:cdStart]
-        self.centralDirectory = data[cdStart:cdEnd]
+        self.endOffset = self.findEndDirectory()
+        self.endDirectory = None
+        self.cdStart = self.cdEnd = 0
+        if self.endOffset is not None:
+            self.endDirectory = EndRecord._make(self.endStruct.unpack_from(data, self.endOffset))
+            endDirectory = self.endDirectory
+            if (0xFFFF in endDirectory[1:5] or 0xFFFFFFFF in endDirectory[5:7]):
+                self.readZip64EndDirectory()
+            # The local directories come before the central directory, the
+            # central directory is read up to its declared size.
+            self.cdStart = min(self.getCDStartOffset(), len(data))
+            self.cdEnd = min(self.cdStart + self.getSizeOfCD(), len(data))
+        self.recordOffset = None
+        self.record = None
         # Flags needed to denote a zip64 file type
         self.zip64Flag = {"ucZip64"     : False,
                           "cZip64"      : False,